@@ -0,0 +1,15 @@
+import pytest
+
+from vocab import create_app
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = create_app()
+    app.config.update(
+        DATABASE=str(tmp_path / 'vocab.db'),
+        DECK_DIR=str(tmp_path / 'decks'),
+        JOBS_DATABASE=str(tmp_path / 'jobs.db'),
+        WARM_CACHES_AFTER_UPDATE=False,
+    )
+    return app
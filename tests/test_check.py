@@ -0,0 +1,45 @@
+import pytest
+
+from vocab.db import unit_of_work
+from vocab.model import DocumentManager, Sentence, VocabEntry
+
+
+def save_entries(app, *entries):
+    with app.app_context():
+        with unit_of_work('vocab') as uow:
+            for entry in entries:
+                uow.save(DocumentManager(entry, doc_id=None, table=None))
+
+
+def check_deck(app):
+    return app.test_cli_runner().invoke(args=['check-deck', '--workers', '1'])
+
+
+def test_valid_deck_passes(app):
+    save_entries(app, VocabEntry('食^たべる', ['to eat'], [Sentence('ご飯^はんを食^たべる', 'eat rice')]),
+                 VocabEntry('漢^かん字^じ', ['kanji'], []))
+
+    result = check_deck(app)
+
+    assert result.exit_code == 0, result.output
+    assert 'Checked 2 entries of deck vocab, 0 failed.' in result.output
+
+
+@pytest.mark.parametrize('word_jp', ['食^', '^たべ', '食^タベ', 'abc^x'])
+def test_malformed_furigana_fails(app, word_jp):
+    save_entries(app, VocabEntry('食^たべる', ['to eat'], []), VocabEntry(word_jp, ['broken'], []))
+
+    result = check_deck(app)
+
+    assert result.exit_code != 0
+    assert '2: word_jp %r' % word_jp in result.output
+    assert '1 failed' in result.output
+
+
+def test_malformed_furigana_in_sentence_fails(app):
+    save_entries(app, VocabEntry('食^たべる', ['to eat'], [Sentence('ご飯^ハンを食べる', 'eat rice')]))
+
+    result = check_deck(app)
+
+    assert result.exit_code != 0
+    assert 'sentence' in result.output
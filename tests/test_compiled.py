@@ -0,0 +1,100 @@
+from vocab.compiled import CompiledDeck, compile_deck, write_compiled
+from vocab.db import current_deck, unit_of_work
+from vocab.model import DocumentManager, Sentence, VocabEntry
+from vocab.vocab import get_vocab
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / 'deck.compiled')
+    documents = [
+        DocumentManager(VocabEntry('食^たべる', ['to eat', 'to live on'],
+                                   [Sentence('ご飯^はんを食^たべる', 'eat rice'), Sentence('食^たべた', None)]),
+                        doc_id=7, table=None, version=3),
+        DocumentManager(VocabEntry('本^ほん', ['book'], []), doc_id=2, table=None, version=1),
+        # shares strings with the first entry
+        DocumentManager(VocabEntry('食^たべる', ['to eat'], [Sentence('食^たべた', None)]), doc_id=5, table=None),
+    ]
+    write_compiled(path, documents)
+
+    compiled = CompiledDeck(path)
+    assert len(compiled) == 3
+    assert list(compiled.doc_ids) == [2, 5, 7]
+    assert compiled.get(1) is None
+    assert compiled.get(8) is None
+
+    dm = compiled.get(7)
+    assert (dm.doc_id, dm.version) == (7, 3)
+    assert dm.entity.word_jp == '食^たべる'
+    assert dm.entity.word_html == '<ruby><a href="https://jisho.org/search/食%20%23kanji">食</a><rt>たべる</rt><ruby>'
+    assert dm.entity.translations == ['to eat', 'to live on']
+    assert [(s.jp, s.translation) for s in dm.entity.sentences] == [('ご飯^はんを食^たべる', 'eat rice'),
+                                                                   ('食^たべた', None)]
+    assert dm.entity.sentences[1].jp_html is not None
+
+    dm = compiled.get(2)
+    assert (dm.entity.word_jp, dm.entity.translations, dm.entity.sentences, dm.version) == ('本^ほん', ['book'], [], 1)
+    assert compiled.get(5).version == 0
+
+
+def test_empty_deck(tmp_path):
+    path = str(tmp_path / 'deck.compiled')
+    write_compiled(path, [])
+
+    compiled = CompiledDeck(path)
+    assert len(compiled) == 0
+    assert list(compiled.doc_ids) == []
+    assert compiled.get(1) is None
+
+
+def save(*dms):
+    with unit_of_work('vocab') as uow:
+        for dm in dms:
+            uow.save(dm)
+
+
+def test_changes_are_served_from_the_change_log(app):
+    with app.app_context():
+        kept, changed, deleted = [DocumentManager(VocabEntry(word, [word], []), doc_id=None, table=None)
+                                  for word in ['本^ほん', '食^たべる', '飲^のむ']]
+        save(kept, changed, deleted)
+        assert compile_deck(current_deck()) == 3
+
+        changed.entity.translations = ['to eat']
+        created = DocumentManager(VocabEntry('見^みる', ['to see'], []), doc_id=None, table=None)
+        save(changed, created)
+        with unit_of_work('vocab') as uow:
+            uow.delete(deleted)
+
+        deck = current_deck()
+        compiled, changes = deck.compiled()
+        assert list(compiled.doc_ids) == [1, 2, 3]
+        assert set(changes) == {2, 3, 4}
+        assert changes[3] is None
+
+        doc_ids = deck.compiled_doc_ids(compiled, changes)
+        assert list(doc_ids) == [1, 2, 4]
+        # merged once per state of the change log
+        assert deck.compiled_doc_ids(*deck.compiled()) is doc_ids
+
+        assert get_vocab(1).entity.translations == ['本^ほん']
+        assert get_vocab(2).entity.translations == ['to eat']
+        assert get_vocab(2).version == 2
+        assert get_vocab(3) is None
+        assert get_vocab(4).entity.word_jp == '見^みる'
+
+
+def test_partly_written_change_is_skipped(app):
+    with app.app_context():
+        dm = DocumentManager(VocabEntry('本^ほん', ['book'], []), doc_id=None, table=None)
+        save(dm)
+        compile_deck(current_deck())
+        dm.entity.translations = ['books']
+        save(dm)
+
+        deck = current_deck()
+        with open(deck.changes_path, 'a', encoding='utf-8') as f:
+            f.write('save 1 {"word_jp": "本^ho')
+
+        compiled, changes = deck.compiled()
+        assert changes[1]['translations'] == ['books']
+        assert get_vocab(1).entity.translations == ['books']
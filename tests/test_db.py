@@ -0,0 +1,31 @@
+from vocab.db import Deck, reset_deck
+from vocab.model import DocumentManager, UnitOfWork, VocabEntry, LAST_IDS_KEY
+
+
+def save(deck, *words):
+    dms = [DocumentManager(VocabEntry(word, [word], []), doc_id=None, table=None) for word in words]
+    with UnitOfWork(deck.storage, 'vocab', lock=deck.lock()) as uow:
+        for dm in dms:
+            uow.save(dm)
+    return [dm.doc_id for dm in dms]
+
+
+def test_doc_id_counter_is_no_table(tmp_path):
+    deck = Deck('test', str(tmp_path / 'test.db'))
+    save(deck, 'a', 'b')
+
+    assert LAST_IDS_KEY in deck.storage.read()
+    assert LAST_IDS_KEY not in deck.db.tables()
+    assert len(deck.db.table('vocab')) == 2
+
+
+def test_purging_tables_keeps_doc_id_counter(tmp_path):
+    deck = Deck('test', str(tmp_path / 'test.db'))
+    assert save(deck, 'a', 'b') == [1, 2]
+
+    deck.db.purge_tables()
+    assert save(deck, 'c') == [3]
+
+    reset_deck(deck)
+    assert save(deck, 'd') == [4]
+    assert [d['word_jp'] for d in deck.db.table('vocab').all()] == ['d']
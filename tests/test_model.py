@@ -0,0 +1,113 @@
+import pytest
+from tinydb.storages import MemoryStorage
+
+from vocab.model import ConflictError, DocumentManager, UnitOfWork, VocabEntry, VERSION_KEY
+
+
+def entry(word):
+    return DocumentManager(VocabEntry(word_jp=word, translations=[word], sentences=[]), doc_id=None, table=None)
+
+
+def stored(storage, doc_id):
+    return storage.read()['vocab'].get(str(doc_id))
+
+
+@pytest.fixture
+def storage():
+    return MemoryStorage()
+
+
+def test_insert_assigns_doc_ids_and_first_version(storage):
+    first, second = entry('a'), entry('b')
+    with UnitOfWork(storage, 'vocab') as uow:
+        uow.save(first)
+        uow.save(second)
+
+    assert (first.doc_id, first.version) == (1, 1)
+    assert (second.doc_id, second.version) == (2, 1)
+    assert stored(storage, 2)['word_jp'] == 'b'
+    assert stored(storage, 2)[VERSION_KEY] == 1
+
+
+def test_update_increments_version(storage):
+    dm = entry('a')
+    with UnitOfWork(storage, 'vocab') as uow:
+        uow.save(dm)
+
+    dm.entity.word_jp = 'b'
+    with UnitOfWork(storage, 'vocab') as uow:
+        uow.save(dm)
+
+    assert dm.version == 2
+    assert stored(storage, dm.doc_id)['word_jp'] == 'b'
+
+
+def test_stale_update_is_rejected(storage):
+    dm = entry('a')
+    with UnitOfWork(storage, 'vocab') as uow:
+        uow.save(dm)
+
+    stale = DocumentManager(VocabEntry('stale', [], []), doc_id=dm.doc_id, table=None, version=dm.version)
+    with UnitOfWork(storage, 'vocab') as uow:
+        uow.save(dm)
+
+    with pytest.raises(ConflictError):
+        with UnitOfWork(storage, 'vocab') as uow:
+            uow.save(stale)
+
+    assert stored(storage, dm.doc_id)['word_jp'] == 'a'
+
+
+def test_conflict_rejects_whole_unit_of_work(storage):
+    dm = entry('a')
+    with UnitOfWork(storage, 'vocab') as uow:
+        uow.save(dm)
+
+    stale = DocumentManager(VocabEntry('stale', [], []), doc_id=dm.doc_id, table=None, version=0)
+    new = entry('new')
+    changes = []
+    with pytest.raises(ConflictError):
+        with UnitOfWork(storage, 'vocab', on_commit=changes.extend) as uow:
+            uow.save(new)
+            uow.save(stale)
+
+    assert new.doc_id is None
+    assert list(storage.read()['vocab']) == [str(dm.doc_id)]
+    assert changes == []
+
+
+def test_delete(storage):
+    dm = entry('a')
+    with UnitOfWork(storage, 'vocab') as uow:
+        uow.save(dm)
+
+    changes = []
+    with UnitOfWork(storage, 'vocab', on_commit=changes.extend) as uow:
+        uow.delete(dm)
+
+    assert stored(storage, dm.doc_id) is None
+    assert changes == [('delete', dm.doc_id)]
+
+    with pytest.raises(ConflictError):
+        with UnitOfWork(storage, 'vocab') as uow:
+            uow.delete(dm)
+
+
+def test_doc_ids_of_deleted_documents_are_not_reused(storage):
+    deleted = entry('a')
+    with UnitOfWork(storage, 'vocab') as uow:
+        uow.save(deleted)
+    stale = DocumentManager(VocabEntry('stale', [], []), doc_id=deleted.doc_id, table=None, version=deleted.version)
+
+    with UnitOfWork(storage, 'vocab') as uow:
+        uow.delete(deleted)
+
+    new = entry('new')
+    with UnitOfWork(storage, 'vocab') as uow:
+        uow.save(new)
+
+    assert new.doc_id != deleted.doc_id
+    with pytest.raises(ConflictError):
+        with UnitOfWork(storage, 'vocab') as uow:
+            uow.save(stale)
+    assert stored(storage, new.doc_id)['word_jp'] == 'new'
@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+
+from vocab.model import DocumentManager, VocabEntry
+from vocab.quiz import QuizEngine
+
+
+def engine(*words):
+    documents = [(i + 1, DocumentManager(VocabEntry(word, [word], []), doc_id=None, table=None).flatten())
+                 for i, word in enumerate(words)]
+    return QuizEngine(documents)
+
+
+def index(quiz, word):
+    return [document['word_jp'] for _, document in quiz.documents].index(word)
+
+
+def choice_words(question):
+    return [choice.entity.word_jp for choice in question.choices]
+
+
+def test_distractors_share_kanji_and_reading():
+    quiz = engine('食^たべる', '食^く', '飲^のむ', '見^みる', '本^ほん', '学校^がっこう', '先生^せんせい', '日本^にほん')
+
+    distractors = quiz.distractors(index(quiz, '食^たべる'), 2, np.random.default_rng(0))
+
+    # "食^く" shares the kanji, "見^みる" the ending and verb class. Both beat the unrelated words
+    assert {quiz.documents[i][1]['word_jp'] for i in distractors} == {'食^く', '見^みる'}
+
+
+def test_entries_with_the_same_word_are_excluded():
+    quiz = engine('食^たべる', '食^たべる', '食^たべる', '食^く', '飲^のむ')
+    rng = np.random.default_rng(0)
+
+    for question in quiz.generate(5, num_choices=4, rng=rng):
+        words = choice_words(question)
+        assert question.answer.entity.word_jp in words
+        # only three distinct words: the duplicates of the answer are never used as distractors
+        assert len(words) == 3
+        assert len(set(words)) == 3
+
+
+def test_missing_distractors_are_picked_at_random():
+    # no features shared with the first word
+    quiz = engine('食^たべる', '本^ほん', '学校^がっこう', '先生^せんせい')
+
+    distractors = quiz.distractors(index(quiz, '食^たべる'), 3, np.random.default_rng(0))
+
+    assert sorted(distractors) == [1, 2, 3]
+
+
+def test_pruned_and_full_scoring_agree():
+    rng = np.random.default_rng(1)
+    kanji = [chr(c) for c in range(0x4e00, 0x4e00 + 50)]
+    hiragana = [chr(c) for c in range(ord('ぁ'), ord('ゖ'))]
+    words = ["%s^%s%s" % ("".join(rng.choice(kanji, 2)), "".join(rng.choice(hiragana, 3)), rng.choice(['る', 'む']))
+             for _ in range(3000)]
+    quiz = engine(*words)
+
+    for answer in rng.choice(len(words), 20, replace=False):
+        features = quiz.entry_features[quiz.entry_ptr[answer]:quiz.entry_ptr[answer + 1]]
+        common = quiz.feature_ptr[features + 1] - quiz.feature_ptr[features] > quiz.common_length
+        assert common.any() and not common.all()
+        full = dict(zip(*quiz.candidates(answer)))
+        candidates, scores = quiz.candidates(answer, skip=common)
+        assert len(candidates) != 0
+        for i, score in zip(candidates, scores):
+            assert score == pytest.approx(full[i])
+
+
+@pytest.mark.parametrize('n, expected', [(-1, 0), (0, 0), (2, 2), (10, 3)])
+def test_number_of_questions_is_clamped(n, expected):
+    quiz = engine('食^たべる', '飲^のむ', '見^みる')
+
+    questions = quiz.generate(n, num_choices=4, rng=np.random.default_rng(0))
+
+    assert len(questions) == expected
+    for question in questions:
+        assert len(question.choices) == 3
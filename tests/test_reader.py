@@ -0,0 +1,21 @@
+import io
+
+from vocab.db import unit_of_work
+from vocab.model import DocumentManager, VocabEntry
+
+
+def test_upload_with_invalid_utf8_is_rendered_completely(app):
+    with app.app_context():
+        with unit_of_work('vocab') as uow:
+            uow.save(DocumentManager(VocabEntry('本^ほん', ['book'], []), doc_id=None, table=None))
+
+    text = '本を読む\n'.encode('utf-8') + b'\xff\xfe broken\n' + ('漢字^かんじ\n' * 1000).encode('utf-8')
+    response = app.test_client().post('/decks/vocab/read', data={'file': (io.BytesIO(text), 'text.txt')},
+                                      content_type='multipart/form-data')
+
+    html = response.get_data(as_text=True)
+    assert response.status_code == 200
+    assert '<mark class="known"><a href="https://jisho.org/search/本%20%23kanji">本</a></mark>' in html
+    assert '\ufffd\ufffdbroken' in html
+    assert html.count('<rt>かんじ</rt>') == 1000
+    assert html.rstrip().endswith('</section>')
@@ -0,0 +1,46 @@
+import re
+
+import pytest
+
+from vocab.db import unit_of_work
+from vocab.model import DocumentManager, VocabEntry
+from vocab.vocab import stored_vocab
+
+
+@pytest.fixture
+def doc_id(app):
+    dm = DocumentManager(VocabEntry('本^ほん', ['book'], []), doc_id=None, table=None)
+    with app.app_context():
+        with unit_of_work('vocab') as uow:
+            uow.save(dm)
+    return dm.doc_id
+
+
+def edit(app, doc_id, **form):
+    form = dict({'word_jp': '本^ほん', 'translations': 'books', 'sentences': ''}, **form)
+    return app.test_client().post('/decks/vocab/edit/%d' % doc_id, data=form)
+
+
+def stored_translations(app, doc_id):
+    with app.app_context():
+        return stored_vocab(doc_id)['translations']
+
+
+def test_edit_with_current_version_is_saved(app, doc_id):
+    response = edit(app, doc_id, version='1')
+
+    assert response.status_code == 302
+    assert stored_translations(app, doc_id) == ['books']
+
+
+@pytest.mark.parametrize('version', [None, '', 'abc', '0'])
+def test_edit_without_current_version_is_a_conflict(app, doc_id, version):
+    form = {} if version is None else {'version': version}
+    response = edit(app, doc_id, **form)
+
+    assert response.status_code == 200
+    assert stored_translations(app, doc_id) == ['book']
+    # the form is shown again with the current version, so that saving again overwrites
+    assert re.search(r'name="version" value="1"', response.get_data(as_text=True))
+    assert edit(app, doc_id, version='1').status_code == 302
+    assert stored_translations(app, doc_id) == ['books']
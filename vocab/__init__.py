@@ -1,6 +1,7 @@
 from flask import Flask
 import os
 from vocab.sentence_parser import render_jp
+from vocab.startup import timed
 
 
 def create_app():
@@ -8,12 +9,16 @@ def create_app():
     Used as Flask app factory.
 
     Creates and configures an instance of the Flask application.
+    Heavy dependencies (tinydb, jsonpickle, wtforms) are imported on first use, and the time spent in each
+    initialization step is recorded for the `startup-report` command.
 
     :return: Initialized flask app
     """
     app = Flask(__name__, instance_relative_config=True)
-    app.secret_key = 'super secret key'
-    app.config.from_object("vocab.config.Config")
+
+    with timed(app, 'config'):
+        app.secret_key = 'super secret key'
+        app.config.from_object("vocab.config.Config")
 
     # ensure the instance folder exists
     try:
@@ -21,15 +26,36 @@ def create_app():
     except OSError:
         pass
 
+    # configure the template cache and register the startup commands. Must happen before `app.jinja_env` is used
+    with timed(app, 'startup'):
+        from vocab import startup
+        startup.init_app(app)
+
     # register the database commands
-    from vocab import db
-    db.init_app(app)
+    with timed(app, 'db'):
+        from vocab import db, compiled
+        db.init_app(app)
+        compiled.init_app(app)
+
+    # register the maintenance commands. Their dependencies (multiprocessing, sockets) are imported when they run
+    with timed(app, 'cli'):
+        from vocab import check, loadtest
+        check.init_app(app)
+        loadtest.init_app(app)
 
     # apply the blueprints to the app
-    from vocab import vocab
-    app.register_blueprint(vocab.bp)
-    app.add_url_rule('/', endpoint='index')
-    app.jinja_env.globals.update(render_jp=render_jp)
+    with timed(app, 'blueprints'):
+        from vocab import vocab, train, reader
+        app.register_blueprint(vocab.decks_bp)
+        app.register_blueprint(vocab.bp)
+        app.register_blueprint(train.bp)
+        app.register_blueprint(reader.bp)
 
-    return app
+    with timed(app, 'jobs'):
+        from vocab import jobs
+        jobs.init_app(app)
+
+    with timed(app, 'jinja'):
+        app.jinja_env.globals.update(render_jp=render_jp)
 
+    return app
@@ -0,0 +1,166 @@
+import os
+
+import click
+from flask.cli import with_appcontext
+
+from vocab.db import current_deck, table, use_deck
+
+# number of documents sent to a worker process at once
+CHUNK_SIZE = 500
+
+
+def check_text(text, errors, rendered, field):
+    """
+    Validates the furigana markup of a japanese text, then parses, groups and renders it. Errors are appended to
+    `errors`, the HTML is stored in `rendered`
+
+    :param text: japanese text
+    :param errors: list of error messages
+    :param rendered: dict of text -> HTML
+    :param field: name of the checked field (used in error messages)
+    """
+    from vocab.sentence_parser import render_jp, validate_jp
+
+    try:
+        validate_jp(text)
+        rendered[text] = str(render_jp(text))
+    except (ValueError, TypeError) as e:
+        errors.append("%s %r: %s" % (field, text, e))
+
+
+def check_verb(word_jp, errors):
+    """
+    Checks that the inflections of a word can be built if the word looks like a verb
+
+    :param word_jp: word as stored in a `VocabEntry`
+    :param errors: list of error messages
+    """
+    from vocab.inflections import Inflections
+    from vocab.quiz import surface_and_reading, verb_class
+
+    try:
+        _, reading = surface_and_reading(word_jp)
+        verb_type = verb_class(reading)
+        if verb_type is not None:
+            inflections = Inflections(reading, verb_type=verb_type)
+            inflections.te()
+            inflections.masu()
+    except (ValueError, TypeError, KeyError) as e:
+        errors.append("word_jp %r: invalid verb: %s" % (word_jp, e))
+
+
+def check_document(doc_id, document):
+    """
+    Checks a single document
+
+    :param doc_id: doc id of the document
+    :param document: tiny db document of a `VocabEntry`
+    :return: tuple of (doc id, list of error messages, dict of text -> HTML)
+    """
+    import jsonpickle
+
+    errors = []
+    rendered = {}
+    try:
+        entry = jsonpickle.Unpickler().restore(document)
+        word_jp = entry.word_jp
+        sentences = entry.sentences
+    except (AttributeError, TypeError, KeyError) as e:
+        return doc_id, ["cannot restore document: %s" % e], rendered
+
+    check_text(word_jp, errors, rendered, 'word_jp')
+    check_verb(word_jp, errors)
+    for sentence in sentences:
+        check_text(sentence.jp, errors, rendered, 'sentence')
+
+    return doc_id, errors, rendered
+
+
+def check_chunk(chunk):
+    """
+    Checks a chunk of documents. Runs in a worker process
+
+    :param chunk: list of `(doc_id, document)` tuples
+    :return: list of results of `check_document`
+    """
+    return [check_document(doc_id, document) for doc_id, document in chunk]
+
+
+def chunked(items, size):
+    """
+    Splits a list into lists of at most `size` items
+    """
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def check_documents(documents, workers, chunk_size=CHUNK_SIZE):
+    """
+    Checks documents in parallel
+
+    :param documents: list of `(doc_id, document)` tuples
+    :param workers: number of worker processes (no processes are started if 1)
+    :param chunk_size: number of documents per chunk
+    :return: generator of results of `check_document`
+    """
+    chunks = chunked(documents, chunk_size)
+
+    if workers == 1:
+        for chunk in chunks:
+            for result in check_chunk(chunk):
+                yield result
+    else:
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+
+        # worker processes are spawned rather than forked: a fork copies the locks held by other threads at that moment
+        # (e.g. by background jobs), which would never be released in the worker
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+            for chunk_results in executor.map(check_chunk, chunks):
+                for result in chunk_results:
+                    yield result
+
+
+@click.command('check-deck')
+@click.option('--deck', default=None, help='Name of the deck to check (default deck if omitted)')
+@click.option('--workers', default=None, type=click.IntRange(min=1),
+              help='Number of worker processes (default: number of cores)')
+@click.option('--chunk-size', default=CHUNK_SIZE, type=click.IntRange(min=1),
+              help='Number of entries sent to a worker at once')
+@click.option('--write', is_flag=True, help='Write the compiled deck with the HTML rendered while checking')
+@with_appcontext
+def check_deck_command(deck, workers, chunk_size, write):
+    from vocab.compiled import compile_deck
+    from vocab.model import VERSION_KEY
+
+    use_deck(deck)
+    deck = current_deck()
+    documents = []
+    for d in table('vocab').all():
+        document = dict(d)
+        document.pop(VERSION_KEY, None)
+        documents.append((d.doc_id, document))
+
+    failures = 0
+    rendered = {}
+    for doc_id, errors, doc_rendered in check_documents(documents, workers or os.cpu_count() or 1, chunk_size):
+        rendered.update(doc_rendered)
+        if len(errors) != 0:
+            failures += 1
+            for error in errors:
+                click.echo('%d: %s' % (doc_id, error))
+
+    click.echo('Checked %d entries of deck %s, %d failed.' % (len(documents), deck.name, failures))
+
+    if write:
+        compile_deck(deck, rendered=rendered)
+        click.echo('Compiled deck %s.' % deck.name)
+
+    if failures != 0:
+        raise click.ClickException('%d entries failed validation' % failures)
+
+
+def init_app(app):
+    """
+    Register deck check functions with the Flask app. This is called by the application factory.
+    """
+    app.cli.add_command(check_deck_command)
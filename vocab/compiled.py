@@ -0,0 +1,268 @@
+import bisect
+import mmap
+import os
+import struct
+
+import click
+from flask import Markup
+from flask.cli import with_appcontext
+
+from vocab.db import current_deck, use_deck
+from vocab.model import DocumentManager, VocabEntry, Sentence
+from vocab.sentence_parser import render_jp
+
+# Layout of a compiled deck (all numbers little endian):
+#
+#   header          magic, format version, entry count and the offsets of the following sections
+#   doc ids         sorted array of u32 doc ids
+#   entries         (u32 version, u64 record offset) for each doc id
+#   records         u32 string ids: word, word html, translation count, translations, sentence count and
+#                   (jp, jp html, translation) for each sentence
+#   string index    (u64 offset, u32 length) for each string id
+#   string pool     UTF-8 encoded strings. Each distinct string is stored once
+MAGIC = b'VOCABDK1'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<8sIIQQQQQ')
+ENTRY = struct.Struct('<IQ')
+STRING = struct.Struct('<QI')
+U32 = struct.Struct('<I')
+
+# string id used for missing strings (sentences without translation, words which cannot be rendered)
+NONE = 0xFFFFFFFF
+
+
+class CompiledVocabEntry(VocabEntry):
+    """
+    `VocabEntry` read from a compiled deck, with the pre-rendered HTML of the word
+    """
+    def __init__(self, word_jp, translations, sentences, word_html):
+        super(CompiledVocabEntry, self).__init__(word_jp, translations, sentences)
+        self.word_html = word_html
+
+
+class CompiledSentence(Sentence):
+    """
+    `Sentence` read from a compiled deck, with the pre-rendered HTML of the japanese sentence
+    """
+    def __init__(self, jp, translation, jp_html):
+        super(CompiledSentence, self).__init__(jp, translation)
+        self.jp_html = jp_html
+
+
+def try_render_jp(text):
+    """
+    Returns the HTML of a japanese text, or `None` if the text cannot be parsed
+    """
+    try:
+        return str(render_jp(text))
+    except (ValueError, TypeError):
+        return None
+
+
+class StringPool(object):
+    """
+    Assigns ids to strings while a compiled deck is written. Equal strings get the same id
+    """
+    def __init__(self):
+        self.ids = {}
+        self.strings = []
+
+    def intern(self, s):
+        if s is None:
+            return NONE
+
+        sid = self.ids.get(s)
+        if sid is None:
+            sid = len(self.strings)
+            self.ids[s] = sid
+            self.strings.append(s.encode('utf-8'))
+        return sid
+
+
+def write_compiled(path, documents, rendered=None):
+    """
+    Writes a compiled deck. The file is replaced atomically.
+
+    :param path: path of the compiled deck
+    :param documents: list of `DocumentManager` objects wrapping `VocabEntry` objects
+    :param rendered: dict of japanese text -> HTML already rendered (texts missing in the dict are rendered here)
+    """
+    documents = sorted(documents, key=lambda dm: dm.doc_id)
+    pool = StringPool()
+
+    if rendered is None:
+        rendered = {}
+
+    def html(text):
+        if text in rendered:
+            return rendered[text]
+        return try_render_jp(text)
+
+    records = []
+    for dm in documents:
+        entry = dm.entity
+        record = [pool.intern(entry.word_jp), pool.intern(html(entry.word_jp)), len(entry.translations)]
+        record.extend([pool.intern(t) for t in entry.translations])
+        record.append(len(entry.sentences))
+        for sentence in entry.sentences:
+            record.extend([pool.intern(sentence.jp), pool.intern(html(sentence.jp)),
+                           pool.intern(sentence.translation)])
+        records.append(record)
+
+    count = len(documents)
+    doc_ids_off = HEADER.size
+    entries_off = doc_ids_off + 4 * count
+    records_off = entries_off + ENTRY.size * count
+    strings_off = records_off + 4 * sum([len(record) for record in records])
+    blob_off = strings_off + STRING.size * len(pool.strings)
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, FORMAT_VERSION, count, doc_ids_off, entries_off, records_off, strings_off,
+                            blob_off))
+        f.write(struct.pack('<%dI' % count, *[dm.doc_id for dm in documents]))
+
+        record_off = records_off
+        for dm, record in zip(documents, records):
+            f.write(ENTRY.pack(dm.version or 0, record_off))
+            record_off += 4 * len(record)
+
+        for record in records:
+            f.write(struct.pack('<%dI' % len(record), *record))
+
+        string_off = blob_off
+        for s in pool.strings:
+            f.write(STRING.pack(string_off, len(s)))
+            string_off += len(s)
+
+        for s in pool.strings:
+            f.write(s)
+
+        f.flush()
+        os.fsync(f.fileno())
+
+    os.replace(tmp_path, path)
+
+
+class CompiledDeck(object):
+    """
+    Read-only view of a compiled deck. The file is memory-mapped, so the pages are shared by all processes reading the
+    same file, and entries are only decoded when they are accessed.
+    """
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        self.view = memoryview(self.mm)
+        magic, version, self.count, doc_ids_off, self.entries_off, self.records_off, self.strings_off, self.blob_off = \
+            HEADER.unpack_from(self.mm, 0)
+
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError("%s is no compiled deck of format version %d" % (path, FORMAT_VERSION))
+
+        # zero-copy view of the sorted doc ids (the file is little endian, as are all supported platforms)
+        self.doc_ids = self.view[doc_ids_off:doc_ids_off + 4 * self.count].cast('I')
+
+    def __len__(self):
+        return self.count
+
+    def _u32(self, offset):
+        return U32.unpack_from(self.mm, offset)[0]
+
+    def _string(self, sid):
+        if sid == NONE:
+            return None
+
+        offset, length = STRING.unpack_from(self.mm, self.strings_off + STRING.size * sid)
+        return str(self.view[offset:offset + length], 'utf-8')
+
+    def _html(self, sid):
+        html = self._string(sid)
+        return None if html is None else Markup(html)
+
+    def get(self, doc_id):
+        """
+        Returns the entry with given doc id
+
+        :param doc_id: doc id of the entry
+        :return: `DocumentManager` wrapping a `CompiledVocabEntry`, or `None` if the deck has no such entry
+        """
+        i = bisect.bisect_left(self.doc_ids, doc_id)
+        if i == self.count or self.doc_ids[i] != doc_id:
+            return None
+
+        version, offset = ENTRY.unpack_from(self.mm, self.entries_off + ENTRY.size * i)
+
+        word_jp = self._string(self._u32(offset))
+        word_html = self._html(self._u32(offset + 4))
+        offset += 8
+
+        n = self._u32(offset)
+        translations = [self._string(self._u32(offset + 4 * (j + 1))) for j in range(n)]
+        offset += 4 * (n + 1)
+
+        n = self._u32(offset)
+        sentences = []
+        for j in range(n):
+            jp, jp_html, translation = struct.unpack_from('<3I', self.mm, offset + 4 + 12 * j)
+            sentences.append(CompiledSentence(self._string(jp), self._string(translation), self._html(jp_html)))
+
+        return DocumentManager(
+            CompiledVocabEntry(word_jp, translations, sentences, word_html),
+            doc_id=doc_id,
+            table=None,
+            version=version)
+
+
+def compiled_doc_ids(compiled, changes):
+    """
+    Returns the doc ids of all entries of a compiled deck, taking changes since the last compile into account
+
+    :param compiled: `CompiledDeck`
+    :param changes: dict of doc id -> tiny db document or `None` if the document was deleted
+    :return: sorted sequence of doc ids
+    """
+    if len(changes) == 0:
+        return compiled.doc_ids
+
+    doc_ids = set(compiled.doc_ids)
+    for doc_id, document in changes.items():
+        if document is None:
+            doc_ids.discard(doc_id)
+        else:
+            doc_ids.add(doc_id)
+    return sorted(doc_ids)
+
+
+def compile_deck(deck, rendered=None):
+    """
+    Writes the compiled deck of a deck and clears its change log
+
+    :param deck: `Deck` object
+    :param rendered: dict of japanese text -> HTML already rendered
+    :return: number of compiled entries
+    """
+    with deck.lock():
+        documents = [DocumentManager.from_document(d, deck.db.table('vocab')) for d in deck.db.table('vocab').all()]
+        write_compiled(deck.compiled_path, documents, rendered=rendered)
+        # all changes are contained in the new compiled deck
+        if os.path.exists(deck.changes_path):
+            os.remove(deck.changes_path)
+
+    return len(documents)
+
+
+@click.command('compile-deck')
+@click.option('--deck', default=None, help='Name of the deck to compile (default deck if omitted)')
+@with_appcontext
+def compile_deck_command(deck):
+    use_deck(deck)
+    count = compile_deck(current_deck())
+    click.echo('Compiled %d entries of deck %s.' % (count, current_deck().name))
+
+
+def init_app(app):
+    """
+    Register compiled deck functions with the Flask app. This is called by the application factory.
+    """
+    app.cli.add_command(compile_deck_command)
@@ -1,4 +1,28 @@
 class Config(object):
     DEBUG = True
     TESTING = True
+    # storage file of the default deck
     DATABASE = 'data/vocab.db'
+    DEFAULT_DECK = 'vocab'
+    # directory holding the storage files of all other decks
+    DECK_DIR = 'data/decks'
+    # number of decks kept open (with their content in memory) by each process
+    MAX_OPEN_DECKS = 8
+
+    # storage file of the background job status
+    JOBS_DATABASE = 'data/jobs.db'
+    # number of threads running background jobs in each process
+    JOB_WORKERS = 2
+    # number of background jobs which may wait or run at the same time in each process
+    JOB_QUEUE_SIZE = 100
+    # number of finished jobs whose status is kept in the job database
+    JOB_HISTORY = 100
+    # rebuild data derived from a deck (known kanji, quiz engine) in the background after it was changed. Off by
+    # default: the data is built on demand anyway, and the rebuild runs in the serving process, where it competes with
+    # requests for the GIL. If enabled, the rebuild is delayed by `WARM_CACHES_DELAY` seconds, so that all changes made
+    # in the meantime are covered by a single rebuild
+    WARM_CACHES_AFTER_UPDATE = False
+    WARM_CACHES_DELAY = 2.0
+
+    # store compiled templates in the instance folder. Run `flask compile-templates` on deploy to fill the cache
+    JINJA_BYTECODE_CACHE = True
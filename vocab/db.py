@@ -1,21 +1,448 @@
-from tinydb import TinyDB
+import fcntl
+import json
+import os
+import re
+import tempfile
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
+
 import click
-from flask import current_app, g
+from flask import abort, current_app, g
 from flask.cli import with_appcontext
 
-# reference to database object. Will be initialized on first call of `get_db`
-_db = None
+from vocab.model import LAST_IDS_KEY
+
+# entries of a storage file which are no tables
+METADATA_KEYS = (LAST_IDS_KEY, )
+
+# valid deck names. Deck names are used as file names, so they must not contain path separators
+DECK_NAME_RE = re.compile(r'^[A-Za-z0-9_-]+$')
+
+# decks opened by this process, least recently used first. Decks are opened on first call of `open_deck` and closed
+# when more than `MAX_OPEN_DECKS` decks are open
+_decks = OrderedDict()
+_decks_lock = threading.Lock()
+
+# functions called with the deck and the list of changes after each commit of `unit_of_work`
+_commit_hooks = []
+
+
+def _reset_after_fork():
+    # the open decks hold locks, which may have been held by other threads of the parent process when it forked
+    global _decks_lock
+
+    _decks.clear()
+    _decks_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def file_stamp(path):
+    """
+    Returns the modification time, size and inode of a file, or `None` if the file does not exist
+    """
+    try:
+        stat = os.stat(path)
+        return stat.st_mtime_ns, stat.st_size, stat.st_ino
+    except OSError:
+        return None
+
+
+class FileLock(object):
+    """
+    Exclusive lock on a lock file, shared by all processes using the same file. Within a process the lock is
+    reentrant for the thread holding it, and other threads wait until it is released.
+    """
+    def __init__(self, path):
+        """
+        :param path: path of the lock file (created on first use)
+        """
+        self.path = path
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._file = None
+
+    def __enter__(self):
+        self._lock.acquire()
+        if self._depth == 0:
+            try:
+                directory = os.path.dirname(self.path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                self._file = open(self.path, 'a')
+                fcntl.flock(self._file, fcntl.LOCK_EX)
+            except Exception:
+                if self._file is not None:
+                    self._file.close()
+                    self._file = None
+                self._lock.release()
+                raise
+
+        self._depth += 1
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._depth -= 1
+        if self._depth == 0:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+        self._lock.release()
+
+
+class DeckStorage(object):
+    """
+    Tiny db storage for a JSON file, which keeps the parsed content in memory until the file is modified.
+
+    Changes of other processes are detected by the modification time, size and inode of the file. Writes replace the
+    file atomically while holding the lock of the deck, so readers never see a partially written file.
+
+    The given tables always exist, even if the file does not contain them. Tiny db creates missing tables by writing the
+    data it has just read, which would overwrite changes written in the meantime by other processes.
+    """
+    def __init__(self, path, lock=None, tables=()):
+        """
+        :param path: path of the JSON file (created on first write)
+        :param lock: `FileLock` held while the file is written
+        :param tables: names of the tables which exist in every deck
+        """
+        self.path = path
+        self.lock = lock
+        self.tables = ('_default', ) + tuple(tables)
+        self.stamp = None
+        self._data = None
+        # guards `stamp` and `_data`, which are shared by all threads of the process
+        self._cache_lock = threading.Lock()
+
+    def _with_tables(self, data):
+        data = dict(data or {})
+        for name in self.tables:
+            data.setdefault(name, {})
+        return data
+
+    def read(self):
+        with self._cache_lock:
+            stamp = file_stamp(self.path)
+            if stamp is None or stamp != self.stamp:
+                if stamp is None or stamp[1] == 0:
+                    data = None
+                else:
+                    with open(self.path, encoding='utf-8') as f:
+                        data = json.load(f)
+
+                self._data = self._with_tables(data)
+                self.stamp = stamp
+
+            return self._data
+
+    def write(self, data):
+        if self.lock is None:
+            self._write(data)
+        else:
+            with self.lock:
+                self._write(data)
+
+    def _write(self, data):
+        directory = os.path.dirname(self.path) or '.'
+        os.makedirs(directory, exist_ok=True)
+
+        with self._cache_lock:
+            # each writer uses its own temporary file, which replaces the storage file when it is complete
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(self.path) + '.', suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    json.dump(data, f)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.path)
+            except Exception:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                # the data may have been modified in place by the caller: read it from the file again
+                self._data = None
+                self.stamp = None
+                raise
+
+            self._data = self._with_tables(data)
+            self.stamp = file_stamp(self.path)
+
+    def close(self):
+        pass
+
+
+class TableStorage(object):
+    """
+    Tiny db storage showing only the tables of a `DeckStorage`. The storage file also holds entries which are no
+    tables (the doc id counters, `LAST_IDS_KEY`), which tiny db would list as tables and drop when it purges them. They
+    are hidden from tiny db, and kept when tiny db writes the tables
+    """
+    def __init__(self, storage):
+        """
+        :param storage: `DeckStorage`
+        """
+        self.storage = storage
+
+    def read(self):
+        data = self.storage.read()
+        return dict([(name, table) for name, table in data.items() if name not in METADATA_KEYS])
+
+    def write(self, data):
+        with self.storage.lock or nullcontext():
+            current = self.storage.read()
+            data = dict(data)
+            for key in METADATA_KEYS:
+                if key in current:
+                    data[key] = current[key]
+            self.storage.write(data)
+
+    def close(self):
+        pass
+
+
+class Deck(object):
+    """
+    An opened deck: its storage, the database object and data derived from the deck (e.g. indexes)
+    """
+    def __init__(self, name, path, tables=('vocab', )):
+        """
+        :param name: name of the deck
+        :param path: path of the storage file
+        :param tables: names of the tables which exist in the deck
+        """
+        self.name = name
+        self.path = path
+        self._lock = FileLock(path + '.lock')
+        self.storage = DeckStorage(path, lock=self._lock, tables=tables)
+        self._db = None
+        self._derived = {}
+
+        # compiled deck (see `vocab.compiled`) and the log of documents changed since it was compiled
+        self.compiled_path = path + '.compiled'
+        self.changes_path = path + '.changes'
+        self._compiled = (None, None)
+        self._changes = (None, {})
+        # (compiled deck, changes, doc ids) of the last call of `compiled_doc_ids`
+        self._doc_ids = (None, None, None)
+
+    @property
+    def db(self):
+        """
+        Database object of the deck. Created on first access, because tiny db reads the whole storage when a table is
+        opened, which routes served from the compiled deck do not need
+        """
+        if self._db is None:
+            from tinydb import TinyDB
+            self._db = TinyDB(storage=lambda: TableStorage(self.storage))
+
+        return self._db
+
+    def clear_cache(self, name):
+        """
+        Clears the query results cached by a table, which are outdated after the table was written
+        """
+        if self._db is not None:
+            self._db.table(name).clear_cache()
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+
+    def cached(self, key, build, incremental=False):
+        """
+        Returns data derived from the deck. The data is built on first call and rebuilt when the deck was modified.
+
+        :param key: name of the derived data
+        :param build: function without arguments building the data
+        :param incremental: if `True`, `build` is called with the data built for the previous state of the deck (or
+                            `None` on first call), so that it can reuse the parts which did not change
+        :return: result of `build`
+        """
+        self.storage.read()
+        stamp = self.storage.stamp
+        entry = self._derived.get(key)
+        if entry is None or entry[0] != stamp:
+            if incremental:
+                data = build(None if entry is None else entry[1])
+            else:
+                data = build()
+            entry = (stamp, data)
+            self._derived[key] = entry
+
+        return entry[1]
+
+    def compiled(self):
+        """
+        Returns the compiled deck together with the documents changed since it was compiled.
+        Both are reloaded when their files change.
+
+        :return: tuple of (`CompiledDeck` or `None` if the deck is not compiled, dict of doc id -> tiny db document or
+                 `None` if the document was deleted)
+        """
+        # the change log is read first: it is only cleared after a new compiled deck was written, so changes are
+        # never missed
+        stamp = file_stamp(self.changes_path)
+        if stamp is None or stamp != self._changes[0]:
+            changes = {}
+            if stamp is not None:
+                with open(self.changes_path, encoding='utf-8') as f:
+                    for line in f:
+                        if not line.endswith('\n'):
+                            # the log is read without the lock, so the last line may still be written. It is read
+                            # again when the file has changed
+                            break
+                        operation, doc_id, document = (line.rstrip('\n').split(' ', 2) + [None])[:3]
+                        changes[int(doc_id)] = json.loads(document) if operation == 'save' else None
+            self._changes = (stamp, changes)
+
+        stamp = file_stamp(self.compiled_path)
+        if stamp != self._compiled[0]:
+            from vocab.compiled import CompiledDeck
+            self._compiled = (stamp, None if stamp is None else CompiledDeck(self.compiled_path))
+
+        return self._compiled[1], self._changes[1]
+
+    def compiled_doc_ids(self, compiled, changes):
+        """
+        Returns the sorted doc ids of the compiled deck, taking the changes since it was compiled into account. The
+        result is kept until the compiled deck or the change log is reloaded
+
+        :param compiled: `CompiledDeck` returned by `compiled`
+        :param changes: changes returned by `compiled`
+        :return: sorted sequence of doc ids
+        """
+        entry = self._doc_ids
+        if entry[0] is not compiled or entry[1] is not changes:
+            from vocab.compiled import compiled_doc_ids
+            entry = (compiled, changes, compiled_doc_ids(compiled, changes))
+            self._doc_ids = entry
+
+        return entry[2]
+
+    def log_changes(self, changes):
+        """
+        Records changed documents in the change log, if the deck is compiled. Saved documents are written to the log,
+        so that they can be served without reading the storage. Must be called while the deck is locked
+
+        :param changes: list of `('save', doc_id)` and `('delete', doc_id)` tuples of the vocab table
+        """
+        if os.path.exists(self.compiled_path):
+            documents = self.storage.read()['vocab']
+            lines = []
+            for operation, doc_id in changes:
+                if operation == 'save':
+                    lines.append("save %d %s\n" % (doc_id, json.dumps(documents[str(doc_id)])))
+                else:
+                    lines.append("delete %d\n" % doc_id)
+
+            with open(self.changes_path, 'a', encoding='utf-8') as f:
+                f.write("".join(lines))
+
+    def lock(self):
+        """
+        Returns the `FileLock` held for all writes to the deck
+        """
+        return self._lock
+
+
+def deck_path(name):
+    """
+    Returns the path of the storage file of a deck. The default deck is stored in `DATABASE`, all other decks in
+    `DECK_DIR`
+
+    :param name: name of the deck
+    :return: path of the storage file
+    """
+    if name == current_app.config['DEFAULT_DECK']:
+        return current_app.config['DATABASE']
+    else:
+        return os.path.join(current_app.config['DECK_DIR'], '%s.db' % name)
+
+
+def deck_names():
+    """
+    Returns the names of all decks, starting with the default deck
+    """
+    default = current_app.config['DEFAULT_DECK']
+    try:
+        files = os.listdir(current_app.config['DECK_DIR'])
+    except OSError:
+        files = []
+
+    names = sorted([f[:-len('.db')] for f in files if f.endswith('.db') and DECK_NAME_RE.match(f[:-len('.db')])])
+    return [default] + [name for name in names if name != default]
+
+
+def deck_exists(name):
+    """
+    Returns whether a deck exists. The default deck always exists, all other decks once they were created with
+    `create_deck`
+    """
+    return name == current_app.config['DEFAULT_DECK'] or os.path.exists(deck_path(name))
+
+
+def create_deck(name):
+    """
+    Creates an empty deck, unless a deck with the given name exists already
+
+    :param name: name of the deck
+    :return: `Deck` object
+    """
+    deck = open_deck(name)
+    with deck.lock():
+        if not os.path.exists(deck.path):
+            deck.storage.write(deck.storage.read())
+
+    return deck
+
+
+def current_deck_name():
+    """
+    Returns the name of the deck of the current request (the default deck outside of deck-scoped routes)
+    """
+    return g.get('deck', current_app.config['DEFAULT_DECK'])
+
+
+def open_deck(name):
+    """
+    Returns the opened deck with given name. The deck is opened on first access and kept open until it is the least
+    recently used of more than `MAX_OPEN_DECKS` open decks.
+
+    :param name: name of the deck
+    :return: `Deck` object
+    """
+    path = deck_path(name)
+    with _decks_lock:
+        deck = _decks.get(path)
+        if deck is None:
+            deck = Deck(name, path)
+            _decks[path] = deck
+        _decks.move_to_end(path)
+
+        while len(_decks) > current_app.config['MAX_OPEN_DECKS']:
+            _, evicted = _decks.popitem(last=False)
+            evicted.close()
+
+    return deck
+
+
+def current_deck():
+    """
+    Returns the opened deck of the current request
+    """
+    return open_deck(current_deck_name())
 
 
 def get_db():
     """
-    Initializes the database on first call and returns it.
-    Each subsequent call returns the same database object.
+    Returns the database object of the deck of the current request.
+    Each subsequent call within the same context returns the same database object.
 
     :return: database object
     """
     if 'db' not in g:
-        g.db = TinyDB(current_app.config['DATABASE'])
+        g.db = current_deck().db
 
     return g.db
 
@@ -32,19 +459,103 @@ def table(name):
 
 def close_db(_=None):
     """
-    Closes the db connection
+    Releases the db connection of the current context. The deck itself stays open for subsequent requests
+    """
+    g.pop('db', None)
+
+
+def scope_to_deck(bp):
     """
-    db = g.pop('db', None)
+    Makes all routes of a blueprint deck-scoped: the deck name is taken from the `deck` URL parameter and stored in
+    `g.deck`, and `url_for` fills in the deck of the current request. Requests for decks which do not exist are
+    answered with 404, so that no deck is created by merely visiting a URL.
+
+    :param bp: blueprint registered with a `url_prefix` containing `<deck>`
+    """
+    @bp.url_value_preprocessor
+    def pull_deck(endpoint, values):
+        deck = values.pop('deck')
+        if DECK_NAME_RE.match(deck) is None or not deck_exists(deck):
+            abort(404)
+        g.deck = deck
+
+    @bp.url_defaults
+    def add_deck(endpoint, values):
+        if 'deck' not in values:
+            values['deck'] = current_deck_name()
+
+
+@contextmanager
+def unit_of_work(name):
+    """
+    Returns a `UnitOfWork` for the table with given name in the deck of the current request. All changes registered in
+    the `with` block are written with a single storage flush when the block is left.
+
+    :param name: name of the table
+    :raises ConflictError: if a document was changed by someone else since it was read
+    """
+    from vocab.model import UnitOfWork
+
+    deck = current_deck()
+    committed = []
+
+    def on_commit(changes):
+        if name == 'vocab':
+            deck.log_changes(changes)
+        committed.extend(changes)
+
+    with UnitOfWork(deck.storage, name, lock=deck.lock(), on_commit=on_commit) as uow:
+        yield uow
 
-    if db is not None:
-        db.close()
+    deck.clear_cache(name)
+
+    for hook in _commit_hooks:
+        hook(deck, committed)
+
+
+def register_commit_hook(hook):
+    """
+    Registers a function called after each commit of `unit_of_work` (e.g. to enqueue follow-up work).
+    The function is called with the `Deck` and a list of `('save', doc_id)` and `('delete', doc_id)` tuples
+
+    :param hook: function to be called
+    """
+    if hook not in _commit_hooks:
+        _commit_hooks.append(hook)
+
+
+def use_deck(deck):
+    """
+    Selects the deck used by a command given with the `--deck` option
+
+    :param deck: name of the deck (default deck if `None`)
+    """
+    if deck is not None:
+        if DECK_NAME_RE.match(deck) is None:
+            raise click.BadParameter('invalid deck name', param_hint='--deck')
+        g.deck = deck
+
+
+def reset_deck(deck):
+    """
+    Deletes all Vocab of a deck, together with its compiled deck and change log
+
+    :param deck: `Deck` object
+    """
+    with deck.lock():
+        deck.db.purge_table('vocab')
+        for path in [deck.compiled_path, deck.changes_path]:
+            if os.path.exists(path):
+                os.remove(path)
 
 
 @click.command('reset-db')
+@click.option('--deck', default=None, help='Name of the deck to reset (default deck if omitted)')
 @with_appcontext
-def reset_db_command():
-    get_db().purge()
-    click.echo('Reset the database.')
+def reset_db_command(deck):
+    use_deck(deck)
+    reset_deck(current_deck())
+    click.echo('Reset the deck %s.' % current_deck_name())
 
 
 def init_app(app):
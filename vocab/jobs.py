@@ -0,0 +1,363 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from flask import Blueprint, current_app, g, jsonify, url_for
+
+from vocab.db import Deck, current_deck_name, register_commit_hook, scope_to_deck
+from vocab.model import DocumentManager, UnitOfWork
+
+bp = Blueprint('jobs', __name__, url_prefix='/jobs')
+
+# routes enqueueing jobs for a deck
+deck_bp = Blueprint('deck_jobs', __name__, url_prefix='/decks/<deck>/jobs')
+scope_to_deck(deck_bp)
+
+# executor running the jobs of this process. Will be initialized on first call of `enqueue`
+_executor = None
+_executor_lock = threading.Lock()
+
+# database holding the job status. Will be initialized on first call of `jobs_deck`
+_jobs_deck = None
+
+# (job name, deck) of all queued jobs, used to enqueue each job at most once
+_queued = {}
+_queued_lock = threading.Lock()
+
+
+class QueueFull(Exception):
+    """
+    Raised when a job is enqueued while `JOB_QUEUE_SIZE` jobs are already waiting or running
+    """
+    pass
+
+
+class Job(object):
+    """
+    Represents a background job and its status
+    """
+    def __init__(self, name, deck, status='queued', created=None, started=None, finished=None, error=None):
+        self.name = name
+        self.deck = deck
+        self.status = status
+        self.created = created
+        self.started = started
+        self.finished = finished
+        self.error = error
+
+
+class JobExecutor(object):
+    """
+    Bounded thread pool running jobs. At most `queue_size` jobs may wait or run at the same time
+    """
+    def __init__(self, workers, queue_size):
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.slots = threading.BoundedSemaphore(queue_size)
+        # futures of submitted jobs and timers of delayed jobs which have not finished yet
+        self.pending = set()
+        self.pending_lock = threading.Lock()
+
+    def submit(self, fn, *args, delay=0):
+        """
+        Runs `fn(*args)` in a worker thread. A delayed job waits in a timer thread, so that it does not occupy a worker
+        until it starts
+
+        :param delay: seconds to wait before the job is handed to a worker
+        :raises QueueFull: if the queue is full
+        """
+        if not self.slots.acquire(blocking=False):
+            raise QueueFull()
+
+        if delay > 0:
+            timer = threading.Timer(delay, self._start, (fn, args))
+            timer.daemon = True
+            with self.pending_lock:
+                self.pending.add(timer)
+            timer.start()
+        else:
+            self._start(fn, args)
+
+    def _start(self, fn, args):
+        with self.pending_lock:
+            # called in the thread of the timer when the job was delayed
+            self.pending.discard(threading.current_thread())
+            future = self.pool.submit(fn, *args)
+            self.pending.add(future)
+        future.add_done_callback(self._done)
+
+    def _done(self, future):
+        with self.pending_lock:
+            self.pending.discard(future)
+        self.slots.release()
+
+    def wait(self):
+        """
+        Waits until all jobs submitted so far (including delayed jobs) have finished
+        """
+        while True:
+            with self.pending_lock:
+                pending = list(self.pending)
+            if len(pending) == 0:
+                return
+
+            for timer in [p for p in pending if isinstance(p, threading.Thread)]:
+                timer.join()
+            wait([p for p in pending if not isinstance(p, threading.Thread)])
+
+
+def get_executor():
+    """
+    Creates the executor of this process on first call and returns it
+    """
+    global _executor
+
+    with _executor_lock:
+        if _executor is None:
+            _executor = JobExecutor(current_app.config['JOB_WORKERS'], current_app.config['JOB_QUEUE_SIZE'])
+
+    return _executor
+
+
+def wait_for_jobs():
+    """
+    Waits until all jobs enqueued by this process so far have finished (e.g. before a worker process exits, as its
+    queued jobs would be lost)
+    """
+    if _executor is not None:
+        _executor.wait()
+
+
+def _reset_after_fork():
+    # the threads of the executor are not copied into a forked process, and locks may be held by them
+    global _executor, _executor_lock, _jobs_deck, _queued_lock
+
+    _executor = None
+    _executor_lock = threading.Lock()
+    _jobs_deck = None
+    _queued.clear()
+    _queued_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def jobs_deck():
+    """
+    Returns the database holding the job status (`JOBS_DATABASE`)
+    """
+    global _jobs_deck
+
+    path = current_app.config['JOBS_DATABASE']
+    with _executor_lock:
+        if _jobs_deck is None or _jobs_deck.path != path:
+            _jobs_deck = Deck('jobs', path, tables=('jobs', ))
+
+    return _jobs_deck
+
+
+def save_job(dm):
+    """
+    Inserts or updates the status of a job. When a job finishes, the status of finished jobs beyond the newest
+    `JOB_HISTORY` is deleted
+    """
+    deck = jobs_deck()
+    with UnitOfWork(deck.storage, 'jobs', lock=deck.lock()) as uow:
+        uow.save(dm)
+
+    if dm.entity.finished is not None:
+        with deck.lock():
+            finished = sorted([int(doc_id) for doc_id, document in deck.storage.read()['jobs'].items()
+                               if document.get('finished') is not None])
+            expired = finished[:max(len(finished) - current_app.config['JOB_HISTORY'], 0)]
+            if len(expired) != 0:
+                with UnitOfWork(deck.storage, 'jobs', lock=deck.lock()) as uow:
+                    for doc_id in expired:
+                        uow.delete(DocumentManager(None, doc_id=doc_id, table=None))
+
+
+def get_job(job_id):
+    """
+    Returns the job with given id
+
+    :param job_id: job id
+    :return: `DocumentManager` wrapping a `Job`, or `None` if there is no such job
+    """
+    table = jobs_deck().db.table('jobs')
+    doc = table.get(doc_id=job_id)
+    if doc is None:
+        return None
+    else:
+        return DocumentManager.from_document(doc, table)
+
+
+def warm_caches():
+    """
+    Builds the data derived from the deck (known kanji of the reader, quiz engine), so that the next request using it
+    does not have to.
+
+    The rebuild is pure Python and runs in a thread of the serving process, so requests served while it runs are
+    slowed down (e.g. the median latency of the edit form rose from 60 ms to 135 ms on a deck of 20k entries). This is
+    why it only runs after updates if `WARM_CACHES_AFTER_UPDATE` is enabled.
+    """
+    from vocab.reader import known_kanji
+    from vocab.train import quiz_engine
+
+    known_kanji()
+    quiz_engine()
+
+
+def compile_current_deck():
+    """
+    Writes the compiled deck of the deck (see `vocab.compiled`)
+    """
+    from vocab.compiled import compile_deck
+    from vocab.db import current_deck
+
+    compile_deck(current_deck())
+
+
+# jobs which can be enqueued by name. Each job runs with the deck it was enqueued for as current deck
+JOBS = {
+    'warm-caches': warm_caches,
+    'compile-deck': compile_current_deck,
+}
+
+
+def run_job(app, dm):
+    """
+    Runs a job in a worker thread and records its status
+
+    :param app: Flask app
+    :param dm: `DocumentManager` wrapping the `Job`. The status is only persisted if the job has a doc id
+    """
+    job = dm.entity
+    with app.app_context():
+        g.deck = job.deck
+        with _queued_lock:
+            _queued.pop((job.name, job.deck), None)
+
+        job.status = 'running'
+        job.started = time.time()
+        if dm.doc_id is not None:
+            save_job(dm)
+
+        try:
+            JOBS[job.name]()
+            job.status = 'done'
+        except Exception as e:
+            app.logger.exception('job %s (%s) failed', dm.doc_id, job.name)
+            job.status = 'failed'
+            job.error = str(e)
+
+        job.finished = time.time()
+        if dm.doc_id is not None:
+            save_job(dm)
+
+
+def enqueue(name, persist=True, delay=0):
+    """
+    Enqueues a job for the deck of the current request and returns immediately.
+    If the same job is already queued for the deck, the queued job is returned instead.
+
+    :param name: name of the job (see `JOBS`)
+    :param persist: record the status of the job in the job database, so that it can be queried by its doc id.
+                    Otherwise the job is only kept in memory
+    :param delay: seconds to wait before the job starts. Enqueueing the same job in the meantime has no effect
+    :return: `DocumentManager` wrapping the `Job`
+    :raises QueueFull: if the queue is full
+    """
+    if name not in JOBS:
+        raise ValueError("unknown job '%s'" % name)
+
+    key = (name, current_deck_name())
+    with _queued_lock:
+        dm = _queued.get(key)
+        if dm is not None:
+            if persist and dm.doc_id is None:
+                save_job(dm)
+            return dm
+
+        dm = DocumentManager(Job(name, current_deck_name(), created=time.time()), doc_id=None, table=None)
+        if persist:
+            save_job(dm)
+
+        try:
+            get_executor().submit(run_job, current_app._get_current_object(), dm, delay=delay)
+        except QueueFull:
+            if persist:
+                dm.entity.status = 'failed'
+                dm.entity.error = 'queue full'
+                save_job(dm)
+            raise
+
+        _queued[key] = dm
+
+    return dm
+
+
+def job_status(dm):
+    """
+    Returns the status of a job as JSON-serializable dict
+    """
+    job = dm.entity
+    return {
+        'id': dm.doc_id,
+        'name': job.name,
+        'deck': job.deck,
+        'status': job.status,
+        'created': job.created,
+        'started': job.started,
+        'finished': job.finished,
+        'error': job.error,
+    }
+
+
+def warm_caches_after_commit(deck, changes):
+    """
+    Commit hook enqueueing `warm-caches` for the changed deck. The job is not persisted, so that requests changing
+    the deck do not have to write the job database
+    """
+    if current_app.config.get('WARM_CACHES_AFTER_UPDATE') and len(changes) != 0:
+        try:
+            enqueue('warm-caches', persist=False, delay=current_app.config['WARM_CACHES_DELAY'])
+        except QueueFull:
+            # the caches are built by the next request instead
+            pass
+
+
+@bp.route('/<int:job_id>')
+def status(job_id):
+    """
+    Route returning the status of a job as JSON
+    """
+    dm = get_job(job_id)
+    if dm is None:
+        return jsonify(error='no such job'), 404
+
+    return jsonify(job_status(dm))
+
+
+@deck_bp.route('/<name>', methods=('POST', ))
+def create(name):
+    """
+    Route enqueueing a job for the deck. Returns the job status with status code 202 and the URL of the status
+    endpoint in the "Location" header
+    """
+    try:
+        dm = enqueue(name)
+    except ValueError:
+        return jsonify(error="unknown job '%s'" % name), 404
+    except QueueFull:
+        return jsonify(error='queue full'), 503
+
+    return jsonify(job_status(dm)), 202, {'Location': url_for('jobs.status', job_id=dm.doc_id)}
+
+
+def init_app(app):
+    """
+    Register the job routes and hooks with the Flask app. This is called by the application factory.
+    """
+    app.register_blueprint(bp)
+    app.register_blueprint(deck_bp)
+    register_commit_hook(warm_caches_after_commit)
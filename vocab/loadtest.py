@@ -0,0 +1,392 @@
+import json
+import logging
+import math
+import os
+import random
+import re
+import threading
+import time
+from urllib.parse import urlencode
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from vocab.db import current_deck, current_deck_name, reset_deck, use_deck, unit_of_work
+from vocab.model import DocumentManager, VocabEntry, Sentence
+
+# relative frequency of the requests sent by each simulated user
+TRAFFIC_MIX = {
+    'index': 50,
+    'edit GET': 25,
+    'create POST': 10,
+    'edit POST': 10,
+    'delete': 5,
+}
+
+# settings of the app affecting caching, recorded with the results so that runs with different settings can be compared
+CACHE_SETTINGS = ['JINJA_BYTECODE_CACHE', 'MAX_OPEN_DECKS', 'WARM_CACHES_AFTER_UPDATE', 'WARM_CACHES_DELAY', 'JOB_WORKERS']
+
+# doc id of a created Vocab in the redirect location, and version of a Vocab in the edit form
+CREATED_RE = re.compile(r'#vocab_(\d+)$')
+VERSION_RE = re.compile(r'name="version" value="(\d+)"')
+
+KANJI = [chr(c) for c in range(0x4e00, 0x4e00 + 2000)]
+HIRAGANA = [chr(c) for c in range(ord('ぁ'), ord('ゖ'))]
+
+
+def synthetic_word(rng):
+    """
+    Returns a random word with furigana (e.g. "乙丁^たすき")
+    """
+    return "%s^%s%s" % ("".join(rng.choices(KANJI, k=rng.randint(1, 2))),
+                        "".join(rng.choices(HIRAGANA, k=rng.randint(2, 4))),
+                        rng.choice(['', 'る', 'む', 'く']))
+
+
+def synthetic_entry(rng):
+    """
+    Returns a random `VocabEntry` with one to three example sentences
+    """
+    sentences = [Sentence("%s%s~%s" % (synthetic_word(rng), rng.choice(HIRAGANA), synthetic_word(rng)),
+                          "sentence %d" % rng.randint(0, 10 ** 6))
+                 for _ in range(rng.randint(1, 3))]
+    return VocabEntry(word_jp=synthetic_word(rng),
+                      translations=["translation %d" % rng.randint(0, 10 ** 6) for _ in range(rng.randint(1, 3))],
+                      sentences=sentences)
+
+
+def seed_deck(size, rng):
+    """
+    Replaces the content of the deck of the current context with `size` synthetic entries, written in one commit
+
+    :return: list of doc ids
+    """
+    reset_deck(current_deck())
+
+    documents = [DocumentManager(synthetic_entry(rng), doc_id=None, table=None) for _ in range(size)]
+    with unit_of_work('vocab') as uow:
+        for dm in documents:
+            uow.save(dm)
+
+    return [dm.doc_id for dm in documents]
+
+
+def percentile(latencies, p):
+    """
+    Returns the `p`-th percentile (nearest rank) of a sorted list of latencies
+    """
+    if len(latencies) == 0:
+        return None
+    return latencies[max(0, int(math.ceil(p / 100.0 * len(latencies))) - 1)]
+
+
+def summarize(latencies, errors, duration, conflicts=0):
+    """
+    Returns throughput, error rate and latency percentiles (in ms) of a list of latencies (in seconds)
+    """
+    latencies = sorted(latencies)
+    count = len(latencies)
+    return {
+        'requests': count,
+        'errors': errors,
+        'conflicts': conflicts,
+        'error_rate': errors / count if count else 0.0,
+        'throughput': count / duration if duration else 0.0,
+        'mean_ms': 1000 * sum(latencies) / count if count else None,
+        'p50_ms': None if count == 0 else 1000 * percentile(latencies, 50),
+        'p95_ms': None if count == 0 else 1000 * percentile(latencies, 95),
+        'p99_ms': None if count == 0 else 1000 * percentile(latencies, 99),
+    }
+
+
+class Client(object):
+    """
+    Simulated user sending requests of the traffic mix to a running server.
+
+    Like a real user, the client only saves the edit form of a Vocab it has opened before, with the version shown in
+    the form. If the Vocab was changed by another client in the meantime, the save is rejected as conflict.
+    """
+    def __init__(self, port, deck, doc_ids, doc_ids_lock, results, rng):
+        self.port = port
+        self.prefix = '/decks/%s' % deck
+        self.doc_ids = doc_ids
+        self.doc_ids_lock = doc_ids_lock
+        self.results = results
+        self.rng = rng
+        self.routes = list(TRAFFIC_MIX)
+        self.weights = [TRAFFIC_MIX[route] for route in self.routes]
+        # doc id -> version of the edit forms opened by this client
+        self.forms = {}
+
+    def request(self, method, path, form=None):
+        """
+        :return: tuple of (status code, "Location" header, body)
+        """
+        import http.client
+
+        conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=30)
+        try:
+            if form is None:
+                conn.request(method, path)
+            else:
+                conn.request(method, path, urlencode(form), {'Content-Type': 'application/x-www-form-urlencoded'})
+            response = conn.getresponse()
+            body = response.read()
+            return response.status, response.getheader('Location'), body
+        finally:
+            conn.close()
+
+    def random_doc_id(self):
+        with self.doc_ids_lock:
+            return self.rng.choice(self.doc_ids) if self.doc_ids else None
+
+    def form(self, version=None):
+        entry = synthetic_entry(self.rng)
+        form = {
+            'word_jp': entry.word_jp,
+            'translations': "\n".join(entry.translations),
+            'sentences': "\n".join(["%s = %s" % (s.jp, s.translation) for s in entry.sentences]),
+        }
+        if version is not None:
+            form['version'] = version
+        return form
+
+    def open_form(self, doc_id):
+        """
+        Requests the edit form of a Vocab and remembers the version shown in it
+        """
+        status, _, body = self.request('GET', '%s/edit/%d' % (self.prefix, doc_id))
+        match = VERSION_RE.search(body.decode('utf-8', 'replace'))
+        if status == 200 and match is not None:
+            self.forms[doc_id] = int(match.group(1))
+        return status
+
+    def step(self):
+        """
+        Sends one request of the traffic mix and records its latency
+        """
+        import http.client
+
+        route = self.rng.choices(self.routes, weights=self.weights)[0]
+        doc_id = self.random_doc_id()
+        if doc_id is None and route != 'create POST':
+            route = 'create POST'
+        if route == 'edit POST' and len(self.forms) != 0:
+            doc_id = self.rng.choice(list(self.forms))
+        elif route == 'edit POST':
+            # no form opened yet
+            route = 'edit GET'
+
+        conflict = False
+        start = time.perf_counter()
+        try:
+            if route == 'index':
+                with self.doc_ids_lock:
+                    pages = max(1, len(self.doc_ids) // 10)
+                status, _, _ = self.request('GET', '%s/?page=%d' % (self.prefix, self.rng.randint(1, min(pages, 20))))
+            elif route == 'edit GET':
+                status = self.open_form(doc_id)
+            elif route == 'create POST':
+                status, location, _ = self.request('POST', '%s/create' % self.prefix, self.form())
+                match = CREATED_RE.search(location or '')
+                if match is not None:
+                    with self.doc_ids_lock:
+                        self.doc_ids.append(int(match.group(1)))
+            elif route == 'edit POST':
+                version = self.forms.pop(doc_id)
+                status, _, _ = self.request('POST', '%s/edit/%d' % (self.prefix, doc_id), self.form(version))
+                # a rejected save shows the form again instead of redirecting
+                conflict = status == 200
+            else:
+                with self.doc_ids_lock:
+                    if doc_id in self.doc_ids:
+                        self.doc_ids.remove(doc_id)
+                status, _, _ = self.request('GET', '%s/delete/%d' % (self.prefix, doc_id))
+            ok = status < 400
+        except (OSError, http.client.HTTPException):
+            ok = False
+
+        latency = time.perf_counter() - start
+        self.results.append((route, latency, ok, conflict))
+
+    def run(self, deadline):
+        while time.perf_counter() < deadline:
+            self.step()
+
+
+def serve_worker(app, sock, threads):
+    """
+    Serves requests accepted on a shared socket until SIGTERM is received. Runs in a forked worker process
+
+    :param app: Flask app
+    :param sock: listening socket shared by all worker processes
+    :param threads: handle requests in threads
+    """
+    import signal
+    from werkzeug.serving import make_server
+    from vocab.jobs import wait_for_jobs
+
+    host, port = sock.getsockname()
+    server = make_server(host, port, app, threaded=threads, fd=sock.fileno())
+    # all workers are woken up by a new connection, but only one accepts it. The others must not block in `accept`
+    server.socket.setblocking(False)
+
+    def stop(signum, frame):
+        # `shutdown` waits for `serve_forever` to return, so it must be called from another thread
+        threading.Thread(target=server.shutdown).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    server.serve_forever()
+    server.server_close()
+    # jobs enqueued while serving would be lost when the process exits
+    wait_for_jobs()
+
+
+def start_workers(app, processes, threads):
+    """
+    Forks worker processes serving the app on a shared listening socket, like a pre-forking application server
+
+    :param app: Flask app
+    :param processes: number of worker processes
+    :param threads: handle requests in threads within each worker process
+    :return: tuple of (port, list of process ids)
+    """
+    import socket
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(('127.0.0.1', 0))
+    sock.listen(128)
+
+    pids = []
+    for _ in range(processes):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                serve_worker(app, sock, threads)
+            except BaseException:
+                app.logger.exception('load test worker failed')
+                code = 1
+            finally:
+                os._exit(code)
+        pids.append(pid)
+
+    port = sock.getsockname()[1]
+    sock.close()
+    return port, pids
+
+
+def stop_workers(pids):
+    """
+    Stops worker processes started by `start_workers` and waits until they have exited
+    """
+    import signal
+
+    for pid in pids:
+        os.kill(pid, signal.SIGTERM)
+    for pid in pids:
+        os.waitpid(pid, 0)
+
+
+@click.command('load-test')
+@click.option('--deck', default='loadtest', help='Name of the deck seeded and used for the test (will be reset)')
+@click.option('--size', default=1000, help='Number of synthetic entries seeded into the deck')
+@click.option('--clients', default=8, help='Number of concurrent simulated users')
+@click.option('--duration', default=10.0, help='Duration of the test in seconds')
+@click.option('--threads/--no-threads', default=True, help='Handle requests in threads')
+@click.option('--processes', default=1, type=click.IntRange(min=1),
+              help='Number of server processes sharing the listening socket. The server always runs in processes '
+                   'separate from the clients, so that both do not compete for the same GIL')
+@click.option('--compiled/--no-compiled', default=False, help='Compile the deck before the test')
+@click.option('--warm-caches/--no-warm-caches', default=None,
+              help='Override WARM_CACHES_AFTER_UPDATE for the test')
+@click.option('--seed', default=0, help='Seed of the random traffic')
+@click.option('--output', default=None, type=click.Path(), help='Write the results as JSON to this file')
+@with_appcontext
+def load_test_command(deck, size, clients, duration, threads, processes, compiled, warm_caches, seed, output):
+    from vocab.compiled import compile_deck
+    from vocab.jobs import wait_for_jobs
+
+    use_deck(deck)
+    rng = random.Random(seed)
+    app = current_app._get_current_object()
+    if warm_caches is not None:
+        app.config['WARM_CACHES_AFTER_UPDATE'] = warm_caches
+
+    click.echo('Seeding %d entries into deck %s...' % (size, current_deck_name()))
+    doc_ids = seed_deck(size, rng)
+    if compiled:
+        compile_deck(current_deck())
+    # jobs enqueued by seeding must not run during the test (or in the worker processes)
+    wait_for_jobs()
+
+    # the request log of the server would drown the report
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+
+    port, pids = start_workers(app, processes, threads)
+
+    results = []
+    doc_ids_lock = threading.Lock()
+    users = [Client(port, current_deck_name(), doc_ids, doc_ids_lock, results,
+                    random.Random(rng.random())) for _ in range(clients)]
+
+    click.echo('Running %d clients for %.1f s...' % (clients, duration))
+    start = time.perf_counter()
+    deadline = start + duration
+    client_threads = [threading.Thread(target=user.run, args=(deadline, )) for user in users]
+    for t in client_threads:
+        t.start()
+    for t in client_threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    stop_workers(pids)
+
+    routes = {}
+    for route in TRAFFIC_MIX:
+        route_results = [r for r in results if r[0] == route]
+        routes[route] = summarize([r[1] for r in route_results], len([r for r in route_results if not r[2]]),
+                                  elapsed, len([r for r in route_results if r[3]]))
+
+    report = {
+        'config': {
+            'deck': current_deck_name(),
+            'size': size,
+            'clients': clients,
+            'duration': duration,
+            'threads': threads,
+            'processes': processes,
+            'compiled': compiled,
+            'seed': seed,
+            'traffic_mix': TRAFFIC_MIX,
+            'settings': dict([(name, app.config.get(name)) for name in CACHE_SETTINGS]),
+        },
+        'elapsed': elapsed,
+        'total': summarize([r[1] for r in results], len([r for r in results if not r[2]]), elapsed,
+                           len([r for r in results if r[3]])),
+        'routes': routes,
+    }
+
+    click.echo('%-12s %8s %8s %9s %8s %9s %9s %9s' % ('route', 'requests', 'errors', 'conflicts', 'req/s', 'p50 ms',
+                                                       'p95 ms', 'p99 ms'))
+    for name, summary in list(routes.items()) + [('total', report['total'])]:
+        if summary['requests'] == 0:
+            click.echo('%-12s %8d' % (name, 0))
+        else:
+            click.echo('%-12s %8d %8d %9d %8.1f %9.1f %9.1f %9.1f' % (
+                name, summary['requests'], summary['errors'], summary['conflicts'], summary['throughput'],
+                summary['p50_ms'], summary['p95_ms'], summary['p99_ms']))
+
+    if output is not None:
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2)
+        click.echo('Wrote results to %s.' % output)
+
+
+def init_app(app):
+    """
+    Register the load test command with the Flask app. This is called by the application factory.
+    """
+    app.cli.add_command(load_test_command)
@@ -1,4 +1,17 @@
-import jsonpickle
+# name of the field holding the version counter of a document. Incremented on every write of the document
+VERSION_KEY = '_version'
+
+# name of the entry of the storage holding the last doc id assigned in each table. Doc ids are never reused, so that a
+# document read before it was deleted cannot be confused with a new document. The entry is no table: decks hide it from
+# tiny db (see `vocab.db.TableStorage`)
+LAST_IDS_KEY = '_last_ids'
+
+
+class ConflictError(Exception):
+    """
+    Raised when a document was changed or deleted by someone else since it was read
+    """
+    pass
 
 
 class DocumentManager(object):
@@ -6,45 +19,58 @@ class DocumentManager(object):
     Manages a database document. Is able to update and insert documents in the database and fetch documents from the
     database.
     """
-    def __init__(self, entity, doc_id, table):
+    def __init__(self, entity, doc_id, table, version=None):
         """
         Initialize an `DocumentManager`
 
         :param entity: An arbitrary tiny db document
         :param doc_id: Document id of the managed document (None, if not persistent)
         :param table: table object to be used
+        :param version: version of the document when it was read. If `None`, writes are not checked for conflicts
         """
         self.entity = entity
         self.doc_id = doc_id
         self.table = table
+        self.version = version
 
     @classmethod
-    def from_document(cls, document, table):
+    def from_document(cls, document, table, doc_id=None):
         """
         Create an `DocumentManager` from a database document
 
-        :param document: tiny db document
+        :param document: tiny db document, or a plain dict as stored in the storage if `doc_id` is given
         :param table: table object
+        :param doc_id: doc id of the document (taken from the tiny db document if `None`)
         :return: `DocumentManager` wrapping the tiny db document
         """
+        import jsonpickle
         u = jsonpickle.Unpickler()
+        document_dict = dict(document)
+        version = document_dict.pop(VERSION_KEY, 0)
         return DocumentManager(
-            entity=u.restore(dict(document)),
-            doc_id=document.doc_id,
-            table=table)
+            entity=u.restore(document_dict),
+            doc_id=document.doc_id if doc_id is None else doc_id,
+            table=table,
+            version=version)
+
+    def flatten(self):
+        """
+        Returns the managed entity as a tiny db document (without version)
+        """
+        import jsonpickle
+        p = jsonpickle.Pickler()
+        return p.flatten(self.entity)
 
     def update(self):
         """
         Insert or update the managed document
+
+        :raises ConflictError: if the document was changed since it was read
         """
-        p = jsonpickle.Pickler()
-        pickled_entry = p.flatten(self.entity)
+        from vocab.db import unit_of_work
 
-        if self.doc_id is None:
-            doc_id = self.table.insert(pickled_entry)
-            self.doc_id = doc_id
-        else:
-            self.table.update(pickled_entry, doc_ids=[self.doc_id])
+        with unit_of_work(self.table.name) as uow:
+            uow.save(self)
 
     def insert(self):
         """
@@ -53,6 +79,117 @@ class DocumentManager(object):
         self.update()
 
 
+class UnitOfWork(object):
+    """
+    Collects inserts, updates and deletes of documents of a single table and writes them to the storage with a single
+    flush on commit.
+
+    Each document carries a version counter. On commit the version of every updated or deleted `DocumentManager` is
+    compared with the stored version, and the whole unit of work is rejected with a `ConflictError` if any of them
+    changed in the meantime.
+
+    Can be used as context manager, which commits when the `with` block is left without an exception.
+    """
+    def __init__(self, storage, table_name, lock=None, on_commit=None):
+        """
+        :param storage: tiny db storage object (supporting `read` and `write`)
+        :param table_name: name of the table the documents belong to
+        :param lock: context manager which is held while the unit of work is committed
+        :param on_commit: function called (while the lock is held) after the changes are written, with a list of
+                          `('save', doc_id)` and `('delete', doc_id)` tuples
+        """
+        self.storage = storage
+        self.table_name = table_name
+        self.lock = lock
+        self.on_commit = on_commit
+        self.operations = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.commit()
+
+    def save(self, dm):
+        """
+        Registers the document of a `DocumentManager` to be inserted (if `dm.doc_id` is `None`) or updated
+        """
+        self.operations.append(('save', dm))
+
+    def delete(self, dm):
+        """
+        Registers the document of a `DocumentManager` to be deleted
+        """
+        self.operations.append(('delete', dm))
+
+    def commit(self):
+        """
+        Checks the versions of all registered documents and writes all changes to the storage.
+        On success, the `doc_id` and `version` of each saved `DocumentManager` are updated.
+
+        :raises ConflictError: if a document was changed or deleted since it was read
+        """
+        if self.lock is None:
+            self._commit()
+        else:
+            with self.lock:
+                self._commit()
+
+    def _commit(self):
+        # copied, so that the data read from the storage stays unchanged if the commit fails
+        data = dict(self.storage.read() or {})
+        documents = dict(data.get(self.table_name, {}))
+        data[self.table_name] = documents
+
+        for _, dm in self.operations:
+            if dm.doc_id is None:
+                continue
+
+            current = documents.get(str(dm.doc_id))
+            if current is None:
+                raise ConflictError("document %d does not exist" % dm.doc_id)
+            if dm.version is not None and current.get(VERSION_KEY, 0) != dm.version:
+                raise ConflictError("document %d was changed by someone else" % dm.doc_id)
+
+        last_ids = dict(data.get(LAST_IDS_KEY, {}))
+        data[LAST_IDS_KEY] = last_ids
+        # storages written before the counter was introduced only know the doc ids of the remaining documents
+        next_id = max([int(doc_id) for doc_id in documents] + [last_ids.get(self.table_name, 0)]) + 1
+        results = []
+        changes = []
+        for operation, dm in self.operations:
+            if operation == 'delete':
+                documents.pop(str(dm.doc_id), None)
+                changes.append(('delete', dm.doc_id))
+                continue
+
+            if dm.doc_id is None:
+                doc_id = next_id
+                next_id += 1
+                version = 1
+            else:
+                doc_id = dm.doc_id
+                version = documents[str(doc_id)].get(VERSION_KEY, 0) + 1
+
+            document = dm.flatten()
+            document[VERSION_KEY] = version
+            documents[str(doc_id)] = document
+            results.append((dm, doc_id, version))
+            changes.append(('save', doc_id))
+
+        last_ids[self.table_name] = next_id - 1
+        self.storage.write(data)
+        self.operations = []
+
+        if self.on_commit is not None:
+            self.on_commit(changes)
+
+        for dm, doc_id, version in results:
+            dm.doc_id = doc_id
+            dm.version = version
+
+
 class VocabEntry(object):
     """
     Represents a vocabulary entry for a database document
@@ -0,0 +1,363 @@
+import functools
+import itertools
+import re
+
+import numpy as np
+
+from vocab.inflections import VerbType, has_ichidan_ending
+from vocab.model import DocumentManager
+from vocab.sentence_parser import is_hiragana, JpRE
+
+# verb classes as stored in the verb class array of a `QuizEngine`
+VERB_CLASSES = {None: 0, VerbType.GODAN: 1, VerbType.ICHIDAN: 2}
+
+# maximum random noise added to the scores of distractors. Less than the smallest feature weight, so that it only breaks
+# ties between equally similar entries
+NOISE = 0.5
+
+# features of more than this share of the entries of a deck (e.g. the last letter of the reading) are common features
+COMMON_FEATURE_SHARE = 0.01
+
+# matches a kanji sequence with optional furigana, furigana without kanji (ignored), or any other character of a word
+# except whitespace and spaces ("~")
+WORD_TOKEN_RE = re.compile(r"(?P<kanji>%s+)(?:\^(?P<furigana>[ぁ-ゟ]*))?|\^[ぁ-ゟ]*|(?P<other>[^\s~])" % JpRE.kanji)
+
+
+def surface_and_reading(word_jp):
+    """
+    Splits a word written with furigana markup (e.g. "食^たべる") into its kanji and its reading (e.g. "たべる").
+    Kanji without furigana are kept in the reading. Gives the same result as grouping the parsed word (see
+    `sentence_parser.group`), but runs a single regular expression, as it is called for every word of a deck.
+
+    :param word_jp: word as stored in a `VocabEntry`
+    :return: tuple of (list of kanji characters, reading `str`)
+    """
+    kanji = []
+    reading = []
+    for match in WORD_TOKEN_RE.finditer(word_jp):
+        sequence, furigana, other = match.group('kanji', 'furigana', 'other')
+        if sequence is not None:
+            kanji.extend(sequence)
+            reading.append(sequence if furigana is None else furigana)
+        elif other is not None:
+            reading.append(other)
+
+    return kanji, "".join(reading)
+
+
+def verb_class(reading):
+    """
+    Guesses the verb class of a word from its reading.
+
+    :param reading: reading of the word
+    :return: `VerbType.ICHIDAN`, `VerbType.GODAN` or `None` if the word does not look like a verb
+    """
+    # only the last two letters are relevant
+    return _verb_class(reading[-2:])
+
+
+@functools.lru_cache(maxsize=4096)
+def _verb_class(reading):
+    if len(reading) < 2 or reading[-1] not in 'るつうくすぶむぬぐ' or not is_hiragana(reading[-2]):
+        return None
+
+    try:
+        if has_ichidan_ending(reading):
+            return VerbType.ICHIDAN
+        else:
+            return VerbType.GODAN
+    except KeyError:
+        # letter before the ending is no regular hiragana letter (e.g. "っ")
+        return VerbType.GODAN
+
+
+def reading_bigrams(reading):
+    """
+    Returns the character bigrams of a reading. The start and the end of the reading are marked with a space, so that
+    words with a common beginning or ending share more bigrams.
+    """
+    padded = " %s " % reading
+    return [padded[i:i+2] for i in range(len(padded) - 1)]
+
+
+def gather_rows(ptr, values, rows):
+    """
+    Returns the given rows of a compressed sparse array, concatenated
+
+    :param ptr: start of each row in `values`, followed by the end of the last row
+    :param values: values of all rows
+    :param rows: array of row indices
+    :return: tuple of (values of the rows, length of each row)
+    """
+    lengths = ptr[rows + 1] - ptr[rows]
+    return values[np.repeat(ptr[rows] - (np.cumsum(lengths) - lengths), lengths) + np.arange(lengths.sum())], lengths
+
+
+class Question(object):
+    """
+    A multiple choice question. The translations of `answer` are shown and the correct word has to be picked from
+    `choices`.
+    """
+    def __init__(self, answer, choices):
+        """
+        :param answer: `DocumentManager` of the asked entry
+        :param choices: list of `DocumentManager` objects including `answer`
+        """
+        self.answer = answer
+        self.choices = choices
+
+
+class QuizEngine(object):
+    """
+    Generates multiple choice questions for a deck of vocab.
+
+    Distractors are chosen by similarity to the asked word: shared kanji, shared reading bigrams and the same verb class.
+    Each distinct kanji and reading bigram of the deck is a feature column. The features of all entries are computed
+    once on construction and stored as posting lists (the entries having each feature), so that only the entries sharing
+    at least one feature with the asked word are scored and ranked.
+    """
+    def __init__(self, documents, kanji_weight=2.0, reading_weight=1.0, verb_class_weight=1.5, previous=None):
+        """
+        :param documents: list of `(doc_id, document)` tuples of tiny db documents of `VocabEntry` objects. The documents
+                          are only restored when they are used in a question
+        :param kanji_weight: score for each kanji shared with the asked word
+        :param reading_weight: score for each reading bigram shared with the asked word
+        :param verb_class_weight: score for having the same verb class as the asked word
+        :param previous: engine built for an earlier state of the same deck. The features of the words it already knows
+                         are reused, so that only new words have to be parsed
+        """
+        self.documents = documents
+        self.weights = (kanji_weight, reading_weight, verb_class_weight)
+
+        # feature -> column, and word -> (feature columns, verb class, word id) of the words of the deck
+        self.columns = {}
+        self.column_weights = []
+        self.words = {}
+        self.next_word_id = 0
+        known_words = {}
+        if previous is not None and previous.weights == self.weights:
+            # copied, because the previous engine may be used by other threads while this one is built
+            self.columns = dict(previous.columns)
+            self.column_weights = list(previous.column_weights)
+            self.next_word_id = previous.next_word_id
+            known_words = previous.words
+
+        n = len(documents)
+        feature_counts = np.empty(n, dtype=np.int64)
+        self.verb_classes = np.empty(n, dtype=np.int8)
+        self.word_ids = np.empty(n, dtype=np.int32)
+        entry_features = []
+        for i, (_, document) in enumerate(documents):
+            word_jp = document.get('word_jp')
+            word = self.words.get(word_jp)
+            if word is None:
+                word = known_words.get(word_jp)
+                if word is None:
+                    word = self._word(word_jp)
+                self.words[word_jp] = word
+            entry_features.append(word[0])
+            feature_counts[i] = len(word[0])
+            self.verb_classes[i] = word[1]
+            self.word_ids[i] = word[2]
+
+        # entries with the same word are never used as distractors for each other
+        self.num_words = len(np.unique(self.word_ids))
+        weights = np.array(self.column_weights, dtype=np.float32)
+
+        # features of each entry (compressed rows) ...
+        self.entry_ptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(feature_counts, out=self.entry_ptr[1:])
+        self.entry_features = np.fromiter(itertools.chain.from_iterable(entry_features), dtype=np.int32,
+                                          count=int(self.entry_ptr[-1]))
+
+        # ... and entries having each feature (compressed columns), with the weight of the feature
+        order = np.argsort(self.entry_features, kind='stable')
+        self.feature_entries = np.repeat(np.arange(n, dtype=np.int32), feature_counts)[order]
+        self.feature_ptr = np.zeros(len(weights) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.entry_features, minlength=len(weights)), out=self.feature_ptr[1:])
+        self.feature_weights = weights
+        # posting lists of common features are only read if the other features do not find enough distractors
+        self.common_length = max(100, int(n * COMMON_FEATURE_SHARE))
+
+    def _columns(self, features, weight):
+        """
+        Returns the columns of features, adding columns for new features
+        """
+        columns = []
+        for feature in features:
+            column = self.columns.get(feature)
+            if column is None:
+                column = len(self.column_weights)
+                self.columns[feature] = column
+                self.column_weights.append(weight)
+            columns.append(column)
+        return columns
+
+    def _word(self, word_jp):
+        """
+        Computes the features of a word and assigns it a word id
+
+        :return: tuple of (feature columns, verb class, word id)
+        """
+        kanji_weight, reading_weight, _ = self.weights
+        try:
+            kanji, reading = surface_and_reading(word_jp)
+            # kanji are single characters and bigrams have two, so they can share the column dict
+            columns = set(self._columns(kanji, kanji_weight))
+            columns.update(self._columns(reading_bigrams(reading), reading_weight))
+            verb_type = VERB_CLASSES[verb_class(reading)]
+        except (ValueError, TypeError):
+            # malformed furigana markup: the entry gets no features and is only picked by chance
+            columns = ()
+            verb_type = 0
+
+        self.next_word_id += 1
+        return tuple(sorted(columns)), verb_type, self.next_word_id - 1
+
+    def entry(self, i):
+        """
+        Returns the i-th entry of the deck
+
+        :return: `DocumentManager` wrapping a `VocabEntry`
+        """
+        doc_id, document = self.documents[i]
+        return DocumentManager.from_document(document, table=None, doc_id=doc_id)
+
+    def candidates(self, answer, skip=None):
+        """
+        Scores the entries sharing at least one feature with the word of an answer as distractors. Entries with the
+        same word as the answer are excluded
+
+        :param answer: entry index
+        :param skip: boolean mask of the features of the answer whose posting lists are not read. Only the entries
+                     having one of the other features are scored, but their scores include all features shared with the
+                     answer
+        :return: tuple of (array of entry indices, array of scores)
+        """
+        answer_features = self.entry_features[self.entry_ptr[answer]:self.entry_ptr[answer + 1]]
+        features = answer_features if skip is None else answer_features[~skip]
+        entries, lengths = gather_rows(self.feature_ptr, self.feature_entries, features)
+
+        # an entry having several of the features appears in several posting lists. The last of its appearances
+        # represents it: the array of the size of the deck is left uninitialized and only read where it was written, so
+        # the work is proportional to the length of the posting lists, not to the size of the deck
+        appearances = np.arange(len(entries))
+        last = np.empty(len(self.documents), dtype=np.int64)
+        last[entries] = appearances
+        representatives = last[entries]
+        scores = np.bincount(representatives, weights=np.repeat(self.feature_weights[features], lengths),
+                             minlength=len(entries))
+        unique = np.flatnonzero(representatives == appearances)
+        unique = unique[self.word_ids[entries[unique]] != self.word_ids[answer]]
+        candidates = entries[unique]
+        scores = scores[unique]
+
+        if skip is not None and skip.any():
+            # the skipped features are looked up in the features of the candidates
+            shared, counts = gather_rows(self.entry_ptr, self.entry_features, candidates)
+            skipped = (shared[:, None] == answer_features[skip][None, :]).any(axis=1)
+            scores += np.bincount(np.repeat(np.arange(len(candidates)), counts),
+                                  weights=np.where(skipped, self.feature_weights[shared], 0), minlength=len(candidates))
+
+        scores = scores.astype(np.float32)
+        answer_class = self.verb_classes[answer]
+        if answer_class != 0:
+            scores += (self.verb_classes[candidates] == answer_class) * np.float32(self.weights[2])
+
+        return candidates, scores
+
+    def _best(self, answer, candidates, scores, num_distractors, rng, minimum=-np.inf):
+        """
+        Returns the entries with the highest scores plus random noise (at most `num_distractors`, with distinct words,
+        and only those scoring at least `minimum`)
+        """
+        chosen = []
+        if len(candidates) == 0:
+            return chosen
+
+        words = {self.word_ids[answer]}
+        scores = scores + rng.random(len(scores), dtype=np.float32) * np.float32(NOISE)
+        # a few more than needed, in case some of the best candidates share a word
+        k = min(len(candidates), 4 * num_distractors)
+        if k < len(candidates):
+            top = np.argpartition(-scores, k - 1)[:k]
+        else:
+            top = np.arange(k)
+        for i in top[np.argsort(-scores[top])]:
+            if len(chosen) == num_distractors or scores[i] < minimum:
+                break
+            if self.word_ids[candidates[i]] not in words:
+                chosen.append(candidates[i])
+                words.add(self.word_ids[candidates[i]])
+
+        return chosen
+
+    def distractors(self, answer, num_distractors, rng):
+        """
+        Picks the distractors of a question: the most similar entries, with random noise breaking ties between equally
+        similar ones. If fewer entries share a feature with the answer, the rest is picked at random. All choices of a
+        question have distinct words
+
+        :param answer: entry index
+        :param num_distractors: number of distractors (less than the number of distinct words of the deck)
+        :param rng: `numpy.random.Generator`
+        :return: list of entry indices
+        """
+        if num_distractors == 0:
+            return []
+
+        chosen = []
+        features = self.entry_features[self.entry_ptr[answer]:self.entry_ptr[answer + 1]]
+        common = self.feature_ptr[features + 1] - self.feature_ptr[features] > self.common_length
+        if 0 < common.sum() < len(features):
+            # entries found only through the long posting lists of the common features score at most `bound`. If enough
+            # entries found through the other features score higher, the long posting lists need not be read
+            bound = self.feature_weights[features[common]].sum() + NOISE
+            if self.verb_classes[answer] != 0:
+                bound += self.weights[2]
+            candidates, scores = self.candidates(answer, skip=common)
+            chosen = self._best(answer, candidates, scores, num_distractors, rng, minimum=bound)
+
+        if len(chosen) < num_distractors:
+            candidates, scores = self.candidates(answer)
+            chosen = self._best(answer, candidates, scores, num_distractors, rng)
+
+        words = set(self.word_ids[[answer] + chosen])
+        while len(chosen) < num_distractors:
+            i = rng.integers(len(self.documents))
+            if self.word_ids[i] not in words:
+                chosen.append(i)
+                words.add(self.word_ids[i])
+
+        return chosen
+
+    def generate(self, n, num_choices=4, rng=None):
+        """
+        Generates a batch of questions for randomly chosen entries of the deck
+
+        :param n: number of questions (at most the size of the deck)
+        :param num_choices: number of choices of each question including the correct answer
+        :param rng: `numpy.random.Generator` used for picking the entries and shuffling the choices
+        :return: list of `Question` objects
+        """
+        if rng is None:
+            rng = np.random.default_rng()
+
+        deck_size = len(self.documents)
+        n = max(0, min(n, deck_size))
+        # choices have distinct words, so only other distinct words can be distractors
+        num_distractors = max(0, min(num_choices - 1, self.num_words - 1))
+        if n == 0:
+            return []
+
+        entries = {}
+        questions = []
+        for answer in rng.choice(deck_size, size=n, replace=False):
+            row = [answer] + self.distractors(answer, num_distractors, rng)
+            rng.shuffle(row)
+            for i in row:
+                if i not in entries:
+                    entries[i] = self.entry(i)
+            questions.append(Question(answer=entries[answer], choices=[entries[i] for i in row]))
+
+        return questions
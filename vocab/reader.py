@@ -0,0 +1,130 @@
+import io
+
+from flask import Blueprint, Markup, Response, current_app, escape, request, stream_with_context
+
+from vocab.db import current_deck, scope_to_deck, table
+from vocab.sentence_parser import iter_group, iter_parse, render_obj, KanjiSequence
+
+bp = Blueprint('reader', __name__, url_prefix='/decks/<deck>')
+scope_to_deck(bp)
+
+# number of template chunks sent at once when a page is streamed (each paragraph of a text is about three chunks)
+STREAM_BUFFER_SIZE = 100
+
+
+def word_kanji(word_jp):
+    """
+    Returns the kanji sequences of a word (e.g. "漢字" for "漢^かん字^じ")
+
+    :param word_jp: word as stored in a `VocabEntry`
+    :return: list of `str`
+    """
+    return ["".join([k.character for k in obj.kanji])
+            for obj in iter_group(iter_parse(word_jp)) if type(obj) is KanjiSequence]
+
+
+def known_kanji():
+    """
+    Returns the set of kanji sequences of all words in the deck, used to highlight known words in a passage.
+    The set is built once per deck and reused until the deck is modified.
+
+    :return: set of `str`
+    """
+    def build():
+        known = set()
+        for document in table('vocab').all():
+            try:
+                known.update(word_kanji(document.get('word_jp', '')))
+            except (ValueError, TypeError):
+                # malformed or missing word
+                pass
+        return known
+
+    return current_deck().cached('known_kanji', build)
+
+
+def paragraphs(lines):
+    """
+    Yields the paragraphs of a text. Each non-empty line is a paragraph.
+
+    :param lines: iterable of lines
+    :return: generator of `str`
+    """
+    for line in lines:
+        line = line.strip()
+        if len(line) != 0:
+            yield line
+
+
+def render_paragraph(text, known):
+    """
+    Returns HTML for a paragraph of japanese text. Kanji sequences which are part of a word in the deck are highlighted.
+
+    :param text: paragraph text
+    :param known: set of known kanji sequences (see `known_kanji`)
+    :return: HTML of the paragraph
+    """
+    html = []
+    for obj in iter_group(iter_parse(text)):
+        if type(obj) is str:
+            html.append(escape(obj))
+        elif type(obj) is KanjiSequence and "".join([k.character for k in obj.kanji]) in known:
+            html.append('<mark class="known">%s</mark>' % render_obj(obj))
+        else:
+            html.append(render_obj(obj))
+
+    return Markup("".join(html))
+
+
+def render_paragraphs(lines, known):
+    """
+    Renders a text paragraph by paragraph
+
+    :param lines: iterable of lines
+    :param known: set of known kanji sequences
+    :return: generator of paragraph HTML
+    """
+    for paragraph in paragraphs(lines):
+        yield render_paragraph(paragraph, known)
+
+
+def stream_template(template_name, **context):
+    """
+    Renders a template as a stream of HTML chunks, so that generators passed in the context are only consumed while
+    the response is sent. Chunks are buffered (see `STREAM_BUFFER_SIZE`), so that each write sends a reasonable amount
+    of data
+
+    :param template_name: name of the template
+    :param context: variables available in the template
+    :return: generator of HTML chunks
+    """
+    current_app.update_template_context(context)
+    template = current_app.jinja_env.get_template(template_name)
+    stream = template.stream(context)
+    stream.enable_buffering(STREAM_BUFFER_SIZE)
+    return stream
+
+
+@bp.route('/read', methods=('GET', 'POST'))
+def read():
+    """
+    Route showing a long japanese text with furigana and highlighted known words.
+
+    The text is either posted in the text box or uploaded as UTF-8 file (invalid bytes are replaced). The response is streamed, and the text is
+    parsed and rendered paragraph by paragraph while it is sent, so neither the text nor the rendered HTML have to be
+    held in memory at once.
+
+    :return: streamed HTML response
+    """
+    lines = []
+    if request.method == 'POST':
+        upload = request.files.get('file')
+        if upload is not None and upload.filename:
+            # the response has already started when the text is decoded, so invalid bytes cannot be reported as error
+            lines = io.TextIOWrapper(upload.stream, encoding='utf-8', errors='replace')
+        else:
+            lines = io.StringIO(request.form.get('text', ''))
+
+    rendered = render_paragraphs(lines, known_kanji())
+    return Response(stream_with_context(stream_template('reader/read.html', paragraphs=rendered)),
+                    mimetype='text/html')
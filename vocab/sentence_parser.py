@@ -86,23 +86,14 @@ def charseq(buf):
     return "".join([c for c in buf if not is_whitespace(c)])
 
 
-def group(tokens):
+def iter_group(tokens):
     """
-    Group a sequence of tokens.
-
-    Tokens can be `Kanji`-objects, `Furigana`-objects, the `SPACE` object or `str`
+    Group a sequence of tokens. Generator version of `group`, which yields each group as soon as it is complete.
 
-    The grouping is done by applying the following rules:
-        - Subsequent `Kanji` objects are grouped to a `KanjiSequence`
-        - If a `Furigana` object follows a `KanjiSequence`, the `Furigana` is added to the `KanjiSequence`
-        - Subsequent `str` characters are grouped to a single `str`
-        - Invalid sequences are ignored without an error (e.g. sequence starting with `Furigana`)
-
-    :param tokens: Sequence of tokens
-    :return: Grouped Tokens
+    :param tokens: iterable of tokens
+    :return: generator of grouped tokens
     """
     state = 'empty'
-    groups = []
     buf = []
     for token in tokens:
         if state == 'empty':
@@ -113,7 +104,7 @@ def group(tokens):
                 buf = [token]
                 state = 'buffer kan'
             elif token == SPACE:
-                groups.append(SPACE)
+                yield SPACE
             elif type(token) is Furigana:
                 # furigana is invalid here: ignore
                 pass
@@ -123,12 +114,12 @@ def group(tokens):
             if type(token) is str:
                 buf.append(token)
             elif type(token) is Kanji:
-                groups.append(charseq(buf))
+                yield charseq(buf)
                 buf = [token]
                 state = 'buffer kan'
             elif token == SPACE:
-                groups.append(charseq(buf))
-                groups.append(SPACE)
+                yield charseq(buf)
+                yield SPACE
                 buf = []
                 state = 'empty'
             elif type(token) is Furigana:
@@ -138,18 +129,18 @@ def group(tokens):
                 raise ValueError("invalid state")
         elif state == 'buffer kan':
             if type(token) is str:
-                groups.append(KanjiSequence(buf, furigana=None))
+                yield KanjiSequence(buf, furigana=None)
                 buf = [token]
                 state = 'buffer str'
             elif type(token) is Kanji:
                 buf.append(token)
             elif type(token) is Furigana:
-                groups.append(KanjiSequence(buf, furigana=token))
+                yield KanjiSequence(buf, furigana=token)
                 buf = []
                 state = 'empty'
             elif token == SPACE:
-                groups.append(KanjiSequence(buf, furigana=None))
-                groups.append(SPACE)
+                yield KanjiSequence(buf, furigana=None)
+                yield SPACE
                 buf = []
                 state = 'empty'
             else:
@@ -160,13 +151,62 @@ def group(tokens):
     if state == 'empty':
         pass
     elif state == 'buffer str':
-        groups.append(charseq(buf))
+        yield charseq(buf)
     elif state == 'buffer kan':
-        groups.append(KanjiSequence(buf, furigana=None))
+        yield KanjiSequence(buf, furigana=None)
     else:
         raise ValueError("invalid state")
 
-    return groups
+
+def group(tokens):
+    """
+    Group a sequence of tokens.
+
+    Tokens can be `Kanji`-objects, `Furigana`-objects, the `SPACE` object or `str`
+
+    The grouping is done by applying the following rules:
+        - Subsequent `Kanji` objects are grouped to a `KanjiSequence`
+        - If a `Furigana` object follows a `KanjiSequence`, the `Furigana` is added to the `KanjiSequence`
+        - Subsequent `str` characters are grouped to a single `str`
+        - Invalid sequences are ignored without an error (e.g. sequence starting with `Furigana`)
+
+    :param tokens: Sequence of tokens
+    :return: Grouped Tokens
+    """
+    return list(iter_group(tokens))
+
+
+# matches a furigana sequence at the current position of the parsed text
+FURIGANA_RE = re.compile(r"\^(?P<furigana>[ぁ-ゟ]*)")
+
+
+def iter_parse(text):
+    """
+    Transforms a text into a sequence of tokens. Generator version of `parse`, which yields each token as soon as it
+    is parsed.
+
+    :param text: text to be parsed
+    :return: generator of tokens
+    """
+    pos = 0
+    while pos < len(text):
+        c = text[pos]
+        if is_kanji(c):
+            yield Kanji(c)
+            pos += 1
+        elif c == "^":
+            match = FURIGANA_RE.match(text, pos)
+            if match is None:
+                raise ValueError("no match")
+
+            yield Furigana(match.group("furigana"))
+            pos = match.end()
+        elif c == "~":
+            yield SPACE
+            pos += 1
+        else:
+            yield c
+            pos += 1
 
 
 def parse(text):
@@ -184,27 +224,31 @@ def parse(text):
     :param text: text to be parsed
     :return: parsed text
     """
-    parsed_sequence = []
-    while len(text) != 0:
-        if is_kanji(text[0]):
-            parsed_sequence.append(Kanji(text[0]))
-            text = text[1:]
-        elif text[0] == "^":
-            match = re.search(r"^\^(?P<furigana>[ぁ-ゟ]*)", text, 0)
-            if match is not None:
-                parsed_sequence.append(Furigana(match.group("furigana")))
-                text = text[len(match.group(0)):]
-                continue
-
-            raise ValueError("no match")
-        elif text[0] == "~":
-            parsed_sequence.append(SPACE)
-            text = text[1:]
-        else:
-            parsed_sequence.append(text[0])
-            text = text[1:]
+    return list(iter_parse(text))
+
 
-    return parsed_sequence
+def validate_jp(text):
+    """
+    Checks the furigana markup of a text. `parse` accepts any text and `group` silently drops furigana it cannot
+    attach, so malformed markup only shows up as missing furigana when the text is rendered.
+
+    The following markup is rejected:
+
+        - "^" not followed by any hiragana (e.g. "食^")
+        - a non-hiragana character right after "^" (e.g. "食^タベ")
+        - furigana with no kanji right before the "^" (e.g. "^たべ" or "abc^x")
+
+    :param text: text to be checked
+    :raises ValueError: describing the first malformed furigana
+    """
+    for match in re.finditer(r"\^", text):
+        pos = match.start()
+        if pos + 1 == len(text):
+            raise ValueError("missing furigana after '^' at position %d" % pos)
+        if not is_hiragana(text[pos + 1]):
+            raise ValueError("non-hiragana character %r after '^' at position %d" % (text[pos + 1], pos))
+        if pos == 0 or not is_kanji(text[pos - 1]):
+            raise ValueError("furigana without kanji at position %d" % pos)
 
 
 def render_obj(obj):
@@ -245,4 +289,4 @@ def render_jp(text):
 
     :return: HTML representing the given text
     """
-    return Markup("".join([render_obj(obj) for obj in group(parse(text))]))
+    return Markup("".join([render_obj(obj) for obj in iter_group(iter_parse(text))]))
@@ -0,0 +1,132 @@
+import importlib
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+# modules that are only imported when they are used for the first time. Listed here to be measured by the
+# `startup-report` command
+LAZY_MODULES = ['tinydb', 'jsonpickle', 'wtforms', 'numpy']
+
+
+@contextmanager
+def timed(app, label):
+    """
+    Measures the time spent in the `with` block and records it in the startup timings of the app
+
+    :param app: flask app
+    :param label: name of the measured step
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        app.extensions.setdefault('startup_timings', []).append((label, time.perf_counter() - start))
+
+
+def bytecode_cache_dir(app):
+    """
+    Returns the directory where compiled templates are cached
+
+    :param app: flask app
+    :return: path of the bytecode cache directory inside the instance folder
+    """
+    return os.path.join(app.instance_path, 'jinja_cache')
+
+
+def init_bytecode_cache(app):
+    """
+    Configures jinja to store compiled templates in the instance folder, so that new workers can load them instead of
+    compiling every template from source.
+
+    Must be called before the jinja environment of the app is accessed for the first time.
+
+    :param app: flask app
+    """
+    from jinja2 import FileSystemBytecodeCache
+
+    cache_dir = bytecode_cache_dir(app)
+    try:
+        os.makedirs(cache_dir)
+    except OSError:
+        pass
+
+    app.jinja_options = dict(app.jinja_options, bytecode_cache=FileSystemBytecodeCache(cache_dir))
+
+
+def compile_templates(app):
+    """
+    Loads every template of the app once, which writes the compiled template to the bytecode cache (if enabled)
+
+    :param app: flask app
+    :return: list of `(template name, seconds)` tuples
+    """
+    timings = []
+    for name in app.jinja_env.list_templates():
+        start = time.perf_counter()
+        app.jinja_env.get_template(name)
+        timings.append((name, time.perf_counter() - start))
+
+    return timings
+
+
+def import_timings(modules):
+    """
+    Imports the given modules and measures the time needed for each import.
+    Modules which are already imported are reported with a time of `None`
+
+    :param modules: list of module names
+    :return: list of `(module name, seconds)` tuples
+    """
+    timings = []
+    for name in modules:
+        if name in sys.modules:
+            timings.append((name, None))
+        else:
+            start = time.perf_counter()
+            importlib.import_module(name)
+            timings.append((name, time.perf_counter() - start))
+
+    return timings
+
+
+def echo_timings(title, timings):
+    click.echo(title)
+    for label, seconds in timings:
+        if seconds is None:
+            click.echo('  %-40s already loaded' % label)
+        else:
+            click.echo('  %-40s %8.2f ms' % (label, seconds * 1000))
+
+
+@click.command('compile-templates')
+@with_appcontext
+def compile_templates_command():
+    if current_app.jinja_env.bytecode_cache is None:
+        click.echo('Jinja bytecode cache is disabled (JINJA_BYTECODE_CACHE). Templates are only checked.')
+
+    timings = compile_templates(current_app)
+    click.echo('Compiled %d templates.' % len(timings))
+
+
+@click.command('startup-report')
+@with_appcontext
+def startup_report_command():
+    echo_timings('App initialization:', current_app.extensions.get('startup_timings', []))
+    echo_timings('Lazy imports:', import_timings(LAZY_MODULES))
+    echo_timings('Template loading:', compile_templates(current_app))
+
+
+def init_app(app):
+    """
+    Register startup functions with the Flask app. This is called by the application factory.
+    """
+    if app.config.get('JINJA_BYTECODE_CACHE'):
+        init_bytecode_cache(app)
+
+    app.cli.add_command(compile_templates_command)
+    app.cli.add_command(startup_report_command)
@@ -2,10 +2,40 @@ from flask import (
     Blueprint, flash, g, redirect, render_template, request, url_for
 )
 from werkzeug.exceptions import abort
-from vocab.db import table
+from vocab.db import current_deck, scope_to_deck, table
 from vocab.model import DocumentManager, VocabEntry, Sentence
-from wtforms import StringField, Form, validators, TextAreaField
 
-bp = Blueprint('train', __name__)
+bp = Blueprint('train', __name__, url_prefix='/decks/<deck>/train')
+scope_to_deck(bp)
 
+QUESTIONS_PER_QUIZ = 10
+MAX_QUESTIONS_PER_QUIZ = 50
+CHOICES_PER_QUESTION = 4
 
+
+def quiz_engine():
+    """
+    Returns the `QuizEngine` of the deck of the current request. The engine is built once per deck and rebuilt from
+    the previous engine when the deck is modified.
+    """
+    from vocab.quiz import QuizEngine
+
+    deck = current_deck()
+
+    def build(previous):
+        documents = sorted([(int(doc_id), document) for doc_id, document in deck.storage.read()['vocab'].items()])
+        return QuizEngine(documents, previous=previous)
+
+    return deck.cached('quiz', build, incremental=True)
+
+
+@bp.route('/quiz')
+def quiz():
+    """
+    Route showing a batch of multiple choice questions. For each question the translations of a Vocab are shown and
+    the Vocab has to be picked among similar looking Vocab.
+    """
+    n = min(request.args.get('n', QUESTIONS_PER_QUIZ, type=int), MAX_QUESTIONS_PER_QUIZ)
+    questions = quiz_engine().generate(n, num_choices=CHOICES_PER_QUESTION)
+
+    return render_template('train/quiz.html', questions=questions)
@@ -2,19 +2,92 @@ from flask import (
     Blueprint, flash, redirect, render_template, request, url_for
 )
 
-from vocab.db import table
-from vocab.model import DocumentManager, VocabEntry, Sentence
-from wtforms import StringField, Form, validators, TextAreaField
+from vocab.db import create_deck, current_deck, deck_names, scope_to_deck, table, unit_of_work, DECK_NAME_RE
+from vocab.model import ConflictError, DocumentManager, VocabEntry, Sentence, VERSION_KEY
 
-bp = Blueprint('vocab', __name__)
+bp = Blueprint('vocab', __name__, url_prefix='/decks/<deck>')
+scope_to_deck(bp)
+
+# routes which are not scoped to a deck
+decks_bp = Blueprint('decks', __name__)
 
 VOCAB_PER_PAGE = 10
 
+# form class. Will be created on first call of `VocabForm`, so wtforms is only imported when a form is rendered
+_vocab_form_class = None
+
+
+def VocabForm(*args, **kwargs):
+    """
+    Creates the form used to create and edit a Vocab.
+    wtforms is imported and the form class is defined on the first call.
+
+    :return: form object
+    """
+    global _vocab_form_class
+
+    if _vocab_form_class is None:
+        from wtforms import StringField, Form, validators, TextAreaField
+
+        class _VocabForm(Form):
+            word_jp = StringField('Word', [validators.Length(min=1, max=100)])
+            translations = TextAreaField('Translations', [validators.Length(min=1, max=255)])
+            sentences = TextAreaField('Sentences')
+
+        _vocab_form_class = _VocabForm
+
+    return _vocab_form_class(*args, **kwargs)
+
+
+@decks_bp.route('/', methods=('GET', 'POST'))
+def decks():
+    """
+    Route showing all decks.
+
+    On "POST" the deck named in the form is created (if it does not exist yet) and shown
+    """
+    if request.method == 'POST':
+        name = request.form.get('name', '').strip()
+        if DECK_NAME_RE.match(name) is None:
+            flash('Deck names may only contain letters, digits, "_" and "-"')
+        else:
+            create_deck(name)
+            return redirect(url_for('vocab.index', deck=name))
+
+    return render_template('vocab/decks.html', decks=deck_names())
+
+
+def get_vocab(doc_id):
+    """
+    Returns the Vocab with given doc id. Served from the compiled deck if the deck is compiled and from its change log
+    if the Vocab was changed since, otherwise from the database
+
+    :param doc_id: doc id of the Vocab
+    :return: `DocumentManager` or `None` if there is no such Vocab
+    """
+    compiled, changes = current_deck().compiled()
+    if compiled is not None:
+        if doc_id not in changes:
+            return compiled.get(doc_id)
+        document = changes[doc_id]
+    else:
+        document = stored_vocab(doc_id)
+
+    if document is None:
+        return None
+    else:
+        return DocumentManager.from_document(document, None, doc_id=doc_id)
+
 
-class VocabForm(Form):
-    word_jp = StringField('Word', [validators.Length(min=1, max=100)])
-    translations = TextAreaField('Translations', [validators.Length(min=1, max=255)])
-    sentences = TextAreaField('Sentences')
+def stored_vocab(doc_id):
+    """
+    Returns the stored document of a Vocab. Looked up in the data of the storage, as tiny db would create a document
+    object for every Vocab of the deck
+
+    :param doc_id: doc id of the Vocab
+    :return: dict or `None` if there is no such Vocab
+    """
+    return current_deck().storage.read()['vocab'].get(str(doc_id))
 
 
 @bp.route('/')
@@ -23,11 +96,22 @@ def index():
     Route showing all Vocab
     """
     page = request.args.get('page', 1, type=int)
-    documents = list(reversed([DocumentManager.from_document(d, table('vocab')) for d in table('vocab').all()]))
+    start, stop = (page-1)*VOCAB_PER_PAGE, page*VOCAB_PER_PAGE
+
+    compiled, changes = current_deck().compiled()
+    if compiled is None:
+        documents = list(reversed(table('vocab').all()))
+        total = len(documents)
+        vocab = [DocumentManager.from_document(d, table('vocab')) for d in documents[start:stop]]
+    else:
+        # newest first
+        doc_ids = current_deck().compiled_doc_ids(compiled, changes)
+        total = len(doc_ids)
+        vocab = [get_vocab(doc_ids[total - 1 - i]) for i in range(max(start, 0), min(stop, total))]
 
     return render_template('vocab/index.html',
-                           vocab=documents[(page-1)*VOCAB_PER_PAGE: page*VOCAB_PER_PAGE],
-                           next_page=page+1 if len(documents) > page*VOCAB_PER_PAGE else None,
+                           vocab=vocab,
+                           next_page=page+1 if total > stop else None,
                            prev_page=page-1 if page > 1 else None)
 
 
@@ -37,10 +121,12 @@ def delete(doc_id):
     Route to delete a given Vocab
     """
     try:
-        table('vocab').remove(doc_ids=[int(doc_id)])
+        with unit_of_work('vocab') as uow:
+            uow.delete(DocumentManager(None, doc_id=int(doc_id), table=table('vocab')))
     except ValueError:
         pass
-    except KeyError:
+    except ConflictError:
+        # already deleted
         pass
 
     return redirect(url_for('vocab.index'))
@@ -98,7 +184,8 @@ def edit(doc_id):
 
     When called as "GET" the edit template is being rendered.
     On "POST" the Vocab will be updated and the index template will be rendered
-    If the payload of the "POST" is invalid, the edit template will be rendered again
+    If the payload of the "POST" is invalid, or the Vocab was changed since the edit template was rendered (or the
+    payload has no valid version to check this), the edit template will be rendered again with the current version
 
     :param doc_id: doc id of Vocab to be edited
     :return: rendered HTML template
@@ -113,6 +200,7 @@ def edit(doc_id):
         word_jp = request.form['word_jp']
         translations_string = request.form['translations']
         sentences_string = request.form['sentences']
+        version = request.form.get('version', type=int)
 
         # ensure that a
         errors = []
@@ -131,25 +219,38 @@ def edit(doc_id):
         dm = DocumentManager(
             VocabEntry(word_jp=word_jp, translations=translations, sentences=sentences),
             doc_id=doc_id,
-            table=table('vocab')
+            table=table('vocab'),
+            version=version
         )
 
-        if len(errors) != 0:
-            flash(", ".join(errors))
-            sentences_string = "\n".join([render_sentence(sentence) for sentence in dm.entity.sentences])
-            form = VocabForm(word_jp=dm.entity.word_jp, translations=translations_string, sentences=sentences_string)
-            return render_template('vocab/edit.html', v=dm, form=form)
-        else:
-            dm.update()
-            return redirect(url_for('vocab.index', _anchor="vocab_%d" % dm.doc_id))
+        if len(errors) == 0:
+            try:
+                if version is None:
+                    # the form has no (valid) version, so changes made in the meantime cannot be detected
+                    raise ConflictError()
+                dm.update()
+                return redirect(url_for('vocab.index', _anchor="vocab_%d" % dm.doc_id))
+            except ConflictError:
+                doc = stored_vocab(doc_id)
+                if doc is None:
+                    flash('Vocab was deleted in the meantime')
+                    return redirect(url_for('vocab.index'))
+
+                # saving again overwrites the changes made in the meantime
+                errors.append('Vocab was changed in the meantime, save again to overwrite')
+                dm.version = doc.get(VERSION_KEY, 0)
+
+        flash(", ".join(errors))
+        sentences_string = "\n".join([render_sentence(sentence) for sentence in dm.entity.sentences])
+        form = VocabForm(word_jp=dm.entity.word_jp, translations=translations_string, sentences=sentences_string)
+        return render_template('vocab/edit.html', v=dm, form=form)
     else:
         try:
             doc_id = int(doc_id)
         except ValueError:
             return redirect(url_for('vocab.index'))
 
-        doc = table('vocab').get(doc_id=doc_id)
-        dm = DocumentManager.from_document(doc, table('vocab'))
+        dm = get_vocab(doc_id)
 
         if dm is not None:
             translations_string = "\n".join(dm.entity.translations)